@@ -0,0 +1,237 @@
+import json
+import multiprocessing
+import os
+import platform
+import subprocess
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+import numpy as np
+import psutil
+from fine_tune_llm import load_trained_model, predict_sva as predict_sva_llm, predict_sva_batch
+from parser import create_parser, parse_sentence, parse_sentences, merge_verb_subject_maps, predict_sva as predict_sva_parser
+
+
+# Fixed benchmark settings so results can be compared between commits
+TEST_FILES = ["./data/test_sva_data.json", "./data/test_real_data.json"]
+BATCH_SIZES = [1, 8, 32]
+LENGTH_BUCKETS = {"short": (0, 12), "medium": (13, 35), "long": (36, None)}  # number of words (inclusive)
+SENTENCES_PER_BUCKET = 64
+WARMUP_BATCHES = 2
+
+
+# Returns the peak resident set size of this process in MB
+# The peak never goes down, so each model is benchmarked in its own process (see benchmark_model)
+def peak_rss_mb():
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Linux reports KB, macOS reports bytes
+        return round(peak / 1024 / (1024 if sys.platform == "darwin" else 1), 1)
+    except ImportError:
+        # Windows has no resource module, but psutil tracks the peak working set
+        return round(psutil.Process().memory_info().peak_wset / 1024 / 1024, 1)
+
+
+# Returns the commit the benchmark is run on (or None if git is not available)
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], text=True, stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+# Returns a fixed subset of sentences from a test file for each sentence length bucket
+# The first SENTENCES_PER_BUCKET sentences of each bucket are taken (no randomness) so every run sees the same input
+def load_subsets(json_file):
+    with open(json_file, "r", encoding="utf-8") as fp:
+        data = json.load(fp)
+
+    subsets = {}
+    for bucket, (low, high) in LENGTH_BUCKETS.items():
+        sentences = []
+        for entry in data:
+            num_words = len(entry["sentence"].split())
+            if num_words >= low and (high is None or num_words <= high):
+                sentences.append(entry["sentence"])
+                if len(sentences) == SENTENCES_PER_BUCKET:
+                    break
+        if sentences:
+            subsets[bucket] = sentences
+
+    return subsets
+
+
+# Splits the sentences into batches of batch_size (the last batch may be smaller)
+def make_batches(sentences, batch_size):
+    return [sentences[i : i + batch_size] for i in range(0, len(sentences), batch_size)]
+
+
+# Returns the latency percentiles (in milliseconds) and throughput of the timed batches
+def summarize(batch_times, num_sentences):
+    latencies_ms = np.array(batch_times) * 1000
+    total_time = sum(batch_times)
+    return {
+        "sentences": num_sentences,
+        "sentences_per_sec": round(num_sentences / total_time, 2) if total_time > 0 else None,
+        "latency_ms_p50": round(float(np.percentile(latencies_ms, 50)), 2),
+        "latency_ms_p95": round(float(np.percentile(latencies_ms, 95)), 2),
+        "latency_ms_p99": round(float(np.percentile(latencies_ms, 99)), 2),
+    }
+
+
+# Times predict_batch on every batch of the sentences, skipping the first few batches as warm-up
+# Latency is measured per batch (a batch of size 1 is a single sentence)
+def time_batches(predict_batch, sentences, batch_size):
+    batches = make_batches(sentences, batch_size)
+
+    for batch in batches[:WARMUP_BATCHES]:
+        predict_batch(batch)
+
+    batch_times = []
+    for batch in batches:
+        start = time.perf_counter()
+        predict_batch(batch)
+        batch_times.append(time.perf_counter() - start)
+
+    return summarize(batch_times, len(sentences))
+
+
+# Returns a function that runs the LLM path on a batch of sentences
+def llm_predictor(tokenizer, model, batch_size):
+    if batch_size == 1:
+        return lambda batch: [predict_sva_llm(tokenizer, model, batch[0])]
+    return lambda batch: predict_sva_batch(tokenizer, model, batch)
+
+
+# Returns a function that runs the parser path on a batch of sentences
+def parser_predictor(nlp, batch_size):
+    if batch_size == 1:
+        return lambda batch: [predict_sva_parser(nlp, merge_verb_subject_maps(parse_sentence(nlp, batch[0])))]
+    return lambda batch: [
+        predict_sva_parser(nlp, merge_verb_subject_maps(results))
+        for results in parse_sentences(nlp, batch, batch_size=batch_size)
+    ]
+
+
+# Runs one model over every test file, length bucket, and batch size
+def run_model(name, make_predictor, subsets_by_file):
+    results = []
+    for json_file, subsets in subsets_by_file.items():
+        for bucket, sentences in subsets.items():
+            for batch_size in BATCH_SIZES:
+                stats = time_batches(make_predictor(batch_size), sentences, batch_size)
+                stats.update({
+                    "model": name,
+                    "test_file": os.path.basename(json_file),
+                    "length_bucket": bucket,
+                    "batch_size": batch_size,
+                    "peak_rss_mb": peak_rss_mb(),
+                })
+                results.append(stats)
+                print(f"  {name} {os.path.basename(json_file)} {bucket} batch={batch_size}: "
+                      f"{stats['sentences_per_sec']} sentences/sec, p50 {stats['latency_ms_p50']} ms")
+    return results
+
+
+# Loads one model ("llm" or "parser") and runs it over every test file, length bucket, and batch size
+# Runs in its own process, so the peak RSS only covers this model
+# Returns the load time, the results, and the peak RSS of the process
+def benchmark_model(name, model_dir, subsets_by_file):
+    start = time.perf_counter()
+    if name == "llm":
+        tokenizer, model = load_trained_model(model_dir, "distilbert-base-uncased")
+        model.eval()
+        make_predictor = lambda b, tokenizer=tokenizer, model=model: llm_predictor(tokenizer, model, b)
+    else:
+        nlp = create_parser()
+        make_predictor = lambda b, nlp=nlp: parser_predictor(nlp, b)
+    load_time = round(time.perf_counter() - start, 3)
+
+    results = run_model(name, make_predictor, subsets_by_file)
+    return load_time, results, peak_rss_mb()
+
+
+# Benchmarks the throughput, latency, memory, and load time of the LLM and the Parser
+# Writes the results to a JSON file that can be compared between commits
+def benchmark(output_file, model_dir="./llm/best_llm"):
+    subsets_by_file = {file: load_subsets(file) for file in TEST_FILES}
+
+    report = {
+        "commit": git_commit(),
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "platform": platform.platform(),
+        "python": platform.python_version(),
+        "cpu_count": os.cpu_count(),
+        "settings": {
+            "batch_sizes": BATCH_SIZES,
+            "length_buckets": LENGTH_BUCKETS,
+            "sentences_per_bucket": SENTENCES_PER_BUCKET,
+            "warmup_batches": WARMUP_BATCHES,
+        },
+        "load_time_sec": {},
+        "peak_rss_mb": {},
+        "results": [],
+    }
+
+    # Each model gets a fresh process, so the memory of one model does not show up in the other's peak
+    context = multiprocessing.get_context("spawn")
+    for name in ("llm", "parser"):
+        print(f"Benchmarking {name}...")
+        with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+            load_time, results, peak = executor.submit(benchmark_model, name, model_dir, subsets_by_file).result()
+        report["load_time_sec"][name] = load_time
+        report["peak_rss_mb"][name] = peak
+        report["results"].extend(results)
+
+    with open(output_file, "w", encoding="utf-8") as fp:
+        json.dump(report, fp, indent=4)
+
+    return report
+
+
+# Compares two benchmark JSON files and prints the relative change of each result
+# Returns the results whose throughput dropped by more than the tolerance (regressions)
+def compare(old_file, new_file, tolerance=0.1):
+    with open(old_file, "r", encoding="utf-8") as fp:
+        old = json.load(fp)
+    with open(new_file, "r", encoding="utf-8") as fp:
+        new = json.load(fp)
+
+    key = lambda r: (r["model"], r["test_file"], r["length_bucket"], r["batch_size"])
+    old_results = {key(r): r for r in old["results"]}
+
+    regressions = []
+    for result in new["results"]:
+        previous = old_results.get(key(result))
+        if previous is None or not previous["sentences_per_sec"] or not result["sentences_per_sec"]:
+            continue
+        change = result["sentences_per_sec"] / previous["sentences_per_sec"] - 1
+        flag = ""
+        if change < -tolerance:
+            regressions.append(result)
+            flag = "  <-- regression"
+        print(f"{' '.join(str(k) for k in key(result))}: "
+              f"{previous['sentences_per_sec']} -> {result['sentences_per_sec']} sentences/sec ({change:+.1%}){flag}")
+
+    for model, load_time in new["load_time_sec"].items():
+        if model in old["load_time_sec"]:
+            print(f"{model} load time: {old['load_time_sec'][model]} -> {load_time} sec")
+    for model, peak in new["peak_rss_mb"].items():
+        if model in old["peak_rss_mb"]:
+            print(f"{model} peak RSS: {old['peak_rss_mb'][model]} -> {peak} MB")
+
+    return regressions
+
+
+if __name__ == "__main__":
+    if len(sys.argv) == 2:
+        benchmark(sys.argv[1])
+    elif len(sys.argv) == 4 and sys.argv[1] == "compare":
+        if compare(sys.argv[2], sys.argv[3]):
+            sys.exit(1)
+    else:
+        print("Usage: benchmark.py <output_json>")
+        print("Usage: benchmark.py compare <old_json> <new_json>")
+        sys.exit(1)
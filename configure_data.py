@@ -1,12 +1,15 @@
 import copy
-import re
 import random
 import csv
 import json
+import os
+import textwrap
 import inflect
 from wonderwords import RandomWord
 import language_tool_python
 from language_tool_python.utils import classify_matches, TextStatus
+from sentence_source import write_sentence_candidates, iter_sentence_candidates
+from dedup import new_dedup_index, check_and_add, close_dedup_index
 
 
 # Word generation 
@@ -19,43 +22,56 @@ all_adjectives = rw.filter(include_parts_of_speech=["adjective"])
 ie = inflect.engine()
 
 # Filtering the 'correct' (grammatically) real sentences
-lt = language_tool_python.LanguageTool("en-US")
+# LanguageTool starts a Java server, so it is only created when it is first needed (not in every process that imports this file)
+lt = None
 
 
-# Writes to a CSV file and a JSON file the sentences from a text file that are over 35 words long (complex) and are likely to be grammatically correct
-# They are all written with label 1  
-def filter_real_sentences(filename):
-    real_sentences = []
+# Returns the LanguageTool instance, creating it on first use
+def get_language_tool():
+    global lt
+    if lt is None:
+        lt = language_tool_python.LanguageTool("en-US")
+    return lt
+
 
-    with open(filename, "r", encoding="utf-8") as fp:
-        data = fp.read()
+# Writes to a CSV file and a JSON file the sentences from text files that are over 35 words long (complex) and are likely to be grammatically correct
+# They are all written with label 1  
+# The text files are read incrementally and split into sentences by parallel workers (see sentence_source.py), so whole corpora can be used
+# If a dedup_index is given, sentences that duplicate earlier sentences (or the SVA sentences) are dropped
+def filter_real_sentences(filenames, workers=None, dedup_index=None):
+    if isinstance(filenames, str):
+        filenames = [filenames]
 
-    # Delete newlines so each sentence can be put on its own line later
-    data = data.replace("\n", " ")
+    # Write the sentences that are over 35 words long to chunk files
+    chunk_files = write_sentence_candidates(filenames, "./data/real_candidates", min_words=35, workers=workers)
 
-    # Get the sentences
-    sentences = re.split(r'[.!?]', data)
+    language_tool = get_language_tool()
+    with open("./data/real_sentences.csv", "w", encoding="utf-8") as fp, open("./data/test_real_data.json", "w", encoding="utf-8") as json_fp:
+        # The JSON file is written one entry at a time so the sentences are never all in memory
+        json_fp.write("[")
+        first = True
 
-    with open("./data/real_sentences.csv", "w", encoding="utf-8") as fp:
         # Iterate over each sentence
-        for sentence in sentences:
-            sentence = sentence.strip()
+        for sentence in iter_sentence_candidates(chunk_files):
+            # Skip duplicates before the costly LanguageTool check (a duplicate of a rejected sentence would be rejected again)
+            if dedup_index is not None and not check_and_add(dedup_index, [sentence], "real"):
+                continue
 
+            # Keep sentences that are likely to be grammatically correct
+            matches = language_tool.check(sentence)
+            status = classify_matches(matches)
+            if status == TextStatus.CORRECT:
+                sentence = sentence.replace('"', "'")
+                entry = {"sentence": sentence, "label": 1}  # all have label 1
 
-            # Keep sentences that are over 35 words long and are likely to be grammatically correct
-            if len(sentence.split()) > 35:
-                matches = lt.check(sentence)
-                status = classify_matches(matches)
-                if status == TextStatus.CORRECT:
-                    sentence = sentence.replace('"', "'")
-                    real_sentences.append({"sentence": sentence, "label": 1})  # all have label 1
+                # Write to CSV file
+                fp.write(f'"{sentence}",1\n')
 
-                    # Write to CSV file
-                    fp.write(f'"{sentence}",1\n')
+                # Write to JSON file
+                json_fp.write(("\n" if first else ",\n") + textwrap.indent(json.dumps(entry, indent=4), "    "))
+                first = False
 
-    # Write to JSON file
-    with open("./data/test_real_data.json", "w", encoding="utf-8") as fp:
-        json.dump(real_sentences, fp, indent=4)
+        json_fp.write("]" if first else "\n]")
 
 
 # Writes to a CSV file the subject-verb agreement errored sentences from M2 files (the last annotation to be made for each sentence will always be SVA)
@@ -361,12 +377,19 @@ def generate_sva_sentence_pairs(n):
             fp.write(f'"{correct}",{1}\n')
 
 
+# Returns the sentences of a pair with the correct sentence (label 1) first
+def correct_first(pair):
+    return [entry["sentence"] for entry in sorted(pair, key=lambda entry: -entry["label"])]
+
+
 # Shuffles and combines the data from the extracted and generated SVA sentence CSV files into three JSON files
 # One JSON file is for training: contains 1/2 of the sentence pairs 
 # One JSON file is for validating: contains one sentence from each pair of another 1/4 of the sentence pairs 
 # One JSON file is for testing: contains one sentence from each pair of the last 1/4 of the sentence pairs
 # The final distribution of kept data: train: 2/3, validation: 1/6, test: 1/6
-def csv_to_json():
+# If keep_pairs is True, also writes the full pairs behind the validation and test sentences to two more JSON files (for pairwise evaluation)
+# If a dedup_index is given, duplicate pairs and pairs that leak into a later split (train, then validation, then test) are dropped before writing
+def csv_to_json(keep_pairs=False, dedup_index=None):
     # Combine the data into one list
     all_sentences = []
     for file in ["./data/extracted_sentences.csv", "./data/generated_sentences.csv"]:
@@ -396,13 +419,23 @@ def csv_to_json():
     remaining_pairs = pairs[train_end:]
 
     # From the remaining pairs, take one sentence from each pair for validation and test
-    remaining_sentences = []
+    # The chosen sentence stays with its pair so the pair-preserving split matches the single-sentence split
+    remaining = []
     for pair in remaining_pairs:
-        remaining_sentences.append(random.choice(pair))
-    random.shuffle(remaining_sentences)
-    valid_end = len(remaining_sentences) // 2
-    valid_sentences = remaining_sentences[:valid_end]
-    test_sentences = remaining_sentences[valid_end:]
+        remaining.append((pair, random.choice(pair)))
+    random.shuffle(remaining)
+    valid_end = len(remaining) // 2
+    valid_remaining = remaining[:valid_end]
+    test_remaining = remaining[valid_end:]
+
+    # Drop exact and near duplicates (checked after all random choices, so the splits stay replicable with a seed)
+    if dedup_index is not None:
+        train_pairs = [pair for pair in train_pairs if check_and_add(dedup_index, correct_first(pair), "train")]
+        valid_remaining = [r for r in valid_remaining if check_and_add(dedup_index, correct_first(r[0]), "valid")]
+        test_remaining = [r for r in test_remaining if check_and_add(dedup_index, correct_first(r[0]), "test")]
+
+    valid_sentences = [sentence for _, sentence in valid_remaining]
+    test_sentences = [sentence for _, sentence in test_remaining]
 
     # Flatten train pairs (keep both sentences in each training pair)
     train_sentences = []
@@ -420,11 +453,26 @@ def csv_to_json():
     with open("./data/test_sva_data.json", "w", encoding="utf-8") as fp:
         json.dump(test_sentences, fp, indent=4)
 
+    # Write the pair-preserving validation and test data (both sentences of each pair)
+    if keep_pairs:
+        with open("./data/valid_sva_pairs.json", "w", encoding="utf-8") as fp:
+            json.dump([pair for pair, _ in valid_remaining], fp, indent=4)
+
+        with open("./data/test_sva_pairs.json", "w", encoding="utf-8") as fp:
+            json.dump([pair for pair, _ in test_remaining], fp, indent=4)
+    else:
+        # Remove the pairs of an earlier configuration so they are not mistaken for pairs of this one
+        for pairs_file in ["./data/valid_sva_pairs.json", "./data/test_sva_pairs.json"]:
+            if os.path.exists(pairs_file):
+                os.remove(pairs_file)
+
 
 # Extracts the SVA sentence pairs from the given M2 files (written to a CSV file)
 # Generates random SVA sentence pairs (written to a CSV file); the number of generated pairs equals the average number of extracted pairs from the M2 files
 # Combines the two CSV files into json files for training, validating, and testing
-def configure_data(seed=None):
+# If keep_pairs is True, the validation and test pairs are also written in full for pairwise evaluation
+# If dedup is True, exact and near duplicates across the extracted, generated, and real sentences are removed (see dedup.py)
+def configure_data(seed=None, keep_pairs=False, dedup=True):
     # Use a seed so the generated data can be replicated
     random.seed(seed)
 
@@ -437,8 +485,16 @@ def configure_data(seed=None):
     # Generate pair_avg synthetic pairs of correct and incorrect SVA sentences
     generate_sva_sentence_pairs(int(pair_avg))
 
+    # Index of the sentences written so far, used to drop duplicates and leakage between splits
+    dedup_index = new_dedup_index() if dedup else None
+
     # Convert outputs from previous functions to shuffled train, validate, and test JSON files
-    csv_to_json()
+    csv_to_json(keep_pairs, dedup_index)
 
     # Create one last test JSON file with complex real-world sentences (all labeled 1) 
-    filter_real_sentences("./data/pg8448.txt")
+    filter_real_sentences("./data/pg8448.txt", dedup_index=dedup_index)
+
+    # Report what was removed
+    if dedup_index is not None:
+        print("Removed duplicates:")
+        close_dedup_index(dedup_index)
@@ -0,0 +1,144 @@
+import hashlib
+import json
+import os
+import re
+import sqlite3
+from collections import defaultdict
+import numpy as np
+
+
+# MinHash settings: NUM_BANDS bands of ROWS_PER_BAND rows; candidates that share a band are compared by their signatures
+NUM_PERM = 32
+NUM_BANDS = 8
+ROWS_PER_BAND = NUM_PERM // NUM_BANDS
+NEAR_DUPLICATE_THRESHOLD = 0.8  # estimated Jaccard similarity of the word shingles
+SHINGLE_SIZE = 3
+
+# Random hash functions (a * h + b) mod PRIME, fixed so the index is the same on every run
+PRIME = 4294967291  # largest 32-bit prime
+rng = np.random.default_rng(8448)
+PERM_A = rng.integers(1, PRIME, size=NUM_PERM, dtype=np.uint64)
+PERM_B = rng.integers(0, PRIME, size=NUM_PERM, dtype=np.uint64)
+
+
+# Returns the signed 64-bit hash of a string or bytes (sqlite integers are signed)
+def hash64(data):
+    if isinstance(data, str):
+        data = data.encode("utf-8")
+    return int.from_bytes(hashlib.blake2b(data, digest_size=8).digest(), "little", signed=True)
+
+
+# Lowercases a sentence and removes punctuation and extra whitespace so trivial differences do not hide duplicates
+def normalize(sentence):
+    return " ".join(re.sub(r"[^\w\s]", " ", sentence.lower()).split())
+
+
+# Returns the MinHash signature of the word shingles of a normalized sentence
+def minhash_signature(normalized):
+    words = normalized.split()
+    shingles = {" ".join(words[i : i + SHINGLE_SIZE]) for i in range(max(1, len(words) - SHINGLE_SIZE + 1))}
+    hashes = np.array(
+        [int.from_bytes(hashlib.blake2b(s.encode("utf-8"), digest_size=4).digest(), "little") for s in shingles],
+        dtype=np.uint64,
+    )
+
+    # Each row is one hash function applied to every shingle; the signature keeps the minimum of each row
+    permuted = (np.outer(PERM_A, hashes) + PERM_B[:, None]) % PRIME
+    return permuted.min(axis=1).astype(np.uint32)
+
+
+# Creates an empty deduplication index backed by an sqlite file, so memory stays bounded for millions of sentences
+# Returns the index (a dict with the database connection and the running report)
+def new_dedup_index(db_file="./data/dedup_index.sqlite", cache_mb=64):
+    if os.path.exists(db_file):
+        os.remove(db_file)
+
+    db = sqlite3.connect(db_file)
+    db.execute("PRAGMA journal_mode = OFF")
+    db.execute("PRAGMA synchronous = OFF")
+    db.execute(f"PRAGMA cache_size = -{cache_mb * 1024}")
+    db.execute("CREATE TABLE exact (hash INTEGER PRIMARY KEY, split TEXT)")
+    db.execute("CREATE TABLE signatures (item INTEGER PRIMARY KEY, split TEXT, signature BLOB)")
+    db.execute("CREATE TABLE bands (key INTEGER, item INTEGER)")
+    db.execute("CREATE INDEX bands_key ON bands (key)")
+
+    return {"db": db, "db_file": db_file, "next_item": 0, "report": defaultdict(lambda: defaultdict(int))}
+
+
+# Returns the split of an earlier exact duplicate of the sentence, or None
+def find_exact(index, normalized):
+    row = index["db"].execute("SELECT split FROM exact WHERE hash = ?", (hash64(normalized),)).fetchone()
+    return row[0] if row else None
+
+
+# Returns the split of an earlier near-duplicate of the sentence, or None
+def find_near(index, signature):
+    for band in range(NUM_BANDS):
+        band_key = hash64(bytes([band]) + signature[band * ROWS_PER_BAND : (band + 1) * ROWS_PER_BAND].tobytes())
+        candidates = index["db"].execute(
+            "SELECT s.split, s.signature FROM bands b JOIN signatures s ON s.item = b.item WHERE b.key = ?", (band_key,)
+        ).fetchall()
+        for split, candidate in candidates:
+            similarity = np.mean(np.frombuffer(candidate, dtype=np.uint32) == signature)
+            if similarity >= NEAR_DUPLICATE_THRESHOLD:
+                return split
+    return None
+
+
+# Adds the exact hashes of the sentences and the MinHash signature of the key sentence to the index
+def add_to_index(index, normalized_sentences, key_signature, split):
+    db = index["db"]
+    db.executemany("INSERT OR IGNORE INTO exact VALUES (?, ?)", [(hash64(n), split) for n in normalized_sentences])
+
+    item = index["next_item"]
+    index["next_item"] += 1
+    db.execute("INSERT INTO signatures VALUES (?, ?, ?)", (item, split, key_signature.tobytes()))
+    db.executemany("INSERT INTO bands VALUES (?, ?)", [
+        (hash64(bytes([band]) + key_signature[band * ROWS_PER_BAND : (band + 1) * ROWS_PER_BAND].tobytes()), item)
+        for band in range(NUM_BANDS)
+    ])
+
+
+# Checks the sentences of one item (a sentence pair, or a single sentence) against everything added before
+# An item is a duplicate if any of its sentences is an exact duplicate, or if its key sentence (the first) is a near-duplicate
+# Returns True and adds the item to the index if it is new; returns False and records why in the report otherwise
+def check_and_add(index, sentences, split):
+    normalized_sentences = [normalize(sentence) for sentence in sentences]
+    report = index["report"][split]
+
+    # Exact duplicates are cheap to find, so check them first
+    match, other_split = "exact", None
+    for normalized in normalized_sentences:
+        other_split = find_exact(index, normalized)
+        if other_split:
+            break
+
+    signature = minhash_signature(normalized_sentences[0])
+    if not other_split:
+        match, other_split = "near", find_near(index, signature)
+
+    if other_split:
+        kind = "duplicates" if other_split == split else f"leakage_from_{other_split}"
+        report[f"{match}_{kind}"] += 1
+        return False
+
+    add_to_index(index, normalized_sentences, signature, split)
+    report["kept"] += 1
+    return True
+
+
+# Writes the report of what was removed to a JSON file, prints a summary, and closes and deletes the index
+def close_dedup_index(index, report_file="./data/dedup_report.json"):
+    index["db"].close()
+    os.remove(index["db_file"])
+
+    report = {split: dict(counts) for split, counts in index["report"].items()}
+    with open(report_file, "w", encoding="utf-8") as fp:
+        json.dump(report, fp, indent=4)
+
+    for split, counts in report.items():
+        removed = sum(count for name, count in counts.items() if name != "kept")
+        details = ", ".join(f"{name}: {count}" for name, count in counts.items() if name != "kept")
+        print(f"  {split}: kept {counts.get('kept', 0)}, removed {removed}{' (' + details + ')' if details else ''}")
+
+    return report
@@ -0,0 +1,179 @@
+import copy
+import json
+import os
+import time
+import torch
+import torch.nn.functional as F
+import polars as pl
+from transformers import AutoModelForSequenceClassification, TrainingArguments, Trainer
+from fine_tune_llm import (
+    load_trained_model, tokenize_function, convert_df_to_dataset, compute_metrics, predict_sva_batch, test
+)
+
+
+# Trainer that learns from the soft labels of a teacher model as well as from the true labels
+class DistillationTrainer(Trainer):
+    def __init__(self, *args, teacher, temperature=2.0, alpha=0.5, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.teacher = teacher.to(self.args.device)
+        self.teacher.eval()
+        self.temperature = temperature
+        self.alpha = alpha
+
+    # Mixes the KL divergence to the softened teacher distribution with the usual cross-entropy loss
+    def compute_loss(self, model, inputs, return_outputs=False, num_items_in_batch=None):
+        outputs = model(**inputs)
+
+        # The teacher only provides targets, so it does not need labels or gradients
+        teacher_inputs = {k: v for k, v in inputs.items() if k != "labels"}
+        with torch.no_grad():
+            teacher_logits = self.teacher(**teacher_inputs).logits
+
+        t = self.temperature
+        soft_loss = F.kl_div(
+            F.log_softmax(outputs.logits / t, dim=-1), F.softmax(teacher_logits / t, dim=-1), reduction="batchmean"
+        ) * (t * t)
+        loss = self.alpha * soft_loss + (1 - self.alpha) * outputs.loss
+
+        return (loss, outputs) if return_outputs else loss
+
+
+# Copies the weights of source into target wherever the parameter shapes still match
+def copy_matching_weights(source, target):
+    target_state = target.state_dict()
+    matching = {name: weights for name, weights in source.state_dict().items()
+                if name in target_state and weights.shape == target_state[name].shape}
+    target.load_state_dict(matching, strict=False)
+
+
+# Creates a smaller DistilBERT student from the teacher
+# Keeps num_layers evenly spaced transformer layers and copies the teacher's weights wherever the shapes still match
+# If the feed-forward size (hidden_dim) is changed, only the feed-forward layers start untrained
+# If the hidden size (dim) is changed, no weights fit and the whole student starts untrained
+def create_student(teacher, num_layers=2, dim=None, hidden_dim=None):
+    config = copy.deepcopy(teacher.config)
+    config.n_layers = num_layers
+    if dim is not None:
+        # Keep the teacher's 64-wide attention heads
+        config.dim = dim
+        config.n_heads = max(1, dim // 64)
+        config.hidden_dim = 4 * dim
+        if dim % config.n_heads != 0:
+            raise ValueError(f"dim ({dim}) must be divisible by the number of attention heads ({config.n_heads}), e.g. a multiple of 64")
+    if hidden_dim is not None:
+        config.hidden_dim = hidden_dim
+
+    student = AutoModelForSequenceClassification.from_config(config)
+
+    teacher_layers = teacher.distilbert.transformer.layer
+    layer_ids = [round(i * (len(teacher_layers) - 1) / max(num_layers - 1, 1)) for i in range(num_layers)]
+
+    copy_matching_weights(teacher.distilbert.embeddings, student.distilbert.embeddings)
+    for student_id, teacher_id in enumerate(layer_ids):
+        copy_matching_weights(teacher_layers[teacher_id], student.distilbert.transformer.layer[student_id])
+    copy_matching_weights(teacher.pre_classifier, student.pre_classifier)
+    copy_matching_weights(teacher.classifier, student.classifier)
+
+    return student
+
+
+# Returns the number of parameters and the size on disk (in MB) of a saved model
+def model_size(model, model_dir):
+    num_params = sum(p.numel() for p in model.parameters())
+    size_mb = sum(
+        os.path.getsize(os.path.join(model_dir, file)) for file in os.listdir(model_dir)
+        if file.endswith((".safetensors", ".bin")) and file != "training_args.bin"
+    ) / 1024 / 1024
+    return num_params, round(size_mb, 1)
+
+
+# Returns the time (in seconds) the model takes to classify all sentences of a test file in batches of batch_size
+def time_inference(tokenizer, model, json_file, batch_size=8):
+    sentences = pl.read_json(json_file)["sentence"].to_list()
+    start = time.perf_counter()
+    for i in range(0, len(sentences), batch_size):
+        predict_sva_batch(tokenizer, model, sentences[i : i + batch_size])
+    return time.perf_counter() - start
+
+
+# Trains a student model to imitate the fine-tuned teacher model on the extracted and generated SVA data
+def train_student(teacher_dir, student_dir, num_layers=2, dim=None, hidden_dim=None, num_epochs=1, temperature=2.0, alpha=0.5):
+    tokenizer, teacher = load_trained_model(teacher_dir, "distilbert-base-uncased")
+    student = create_student(teacher, num_layers, dim, hidden_dim)
+
+    # Load training and valid dataset
+    pl_train = pl.read_json("./data/train_sva_data.json").to_pandas()
+    pl_valid = pl.read_json("./data/valid_sva_data.json").to_pandas()
+    dataset = convert_df_to_dataset(pl_train, pl_valid)
+    tokenized_datasets = dataset.map(lambda x: tokenize_function(tokenizer, x), batched=True)
+
+    training_args = TrainingArguments(
+        output_dir=student_dir,         # Directory to save the model
+        num_train_epochs=num_epochs,    # Total number of training epochs
+        per_device_train_batch_size=8,  # Batch size for training
+        per_device_eval_batch_size=8,   # Batch size for evaluation
+        logging_steps=50,               # Log every 50 steps
+        eval_strategy="epoch",          # Run evaluation at the end of each epoch
+        save_strategy="epoch",          # Save the model at the end of each epoch
+        load_best_model_at_end=True,    # Load the best model found during training
+        save_total_limit=1,             # Only keep the best checkpoint
+    )
+
+    trainer = DistillationTrainer(
+        model=student,
+        args=training_args,
+        train_dataset=tokenized_datasets["train"],
+        eval_dataset=tokenized_datasets["validation"],
+        compute_metrics=compute_metrics,
+        teacher=teacher,
+        temperature=temperature,
+        alpha=alpha,
+    )
+    trainer.train()
+
+    # Save the student so it can be loaded like any other fine-tuned model
+    trainer.save_model(student_dir)
+
+    return student_dir
+
+
+# Compares the student with the teacher on both test files: accuracy, speedup, and model size reduction
+def compare_student(teacher_dir, student_dir):
+    tokenizer, teacher = load_trained_model(teacher_dir, "distilbert-base-uncased")
+    _, student = load_trained_model(student_dir, "distilbert-base-uncased")
+
+    report = {"test_files": {}}
+    for file in ["./data/test_sva_data.json", "./data/test_real_data.json"]:
+        teacher_time = time_inference(tokenizer, teacher, file)
+        student_time = time_inference(tokenizer, student, file)
+        report["test_files"][os.path.basename(file)] = {
+            "teacher_accuracy": round(test("distilbert-base-uncased", teacher_dir, file, loaded=(tokenizer, teacher)), 3),
+            "student_accuracy": round(test("distilbert-base-uncased", student_dir, file, loaded=(tokenizer, student)), 3),
+            "speedup": round(teacher_time / student_time, 2),
+        }
+
+    teacher_params, teacher_mb = model_size(teacher, teacher_dir)
+    student_params, student_mb = model_size(student, student_dir)
+    report["teacher_parameters"] = teacher_params
+    report["student_parameters"] = student_params
+    report["teacher_size_mb"] = teacher_mb
+    report["student_size_mb"] = student_mb
+    report["size_reduction"] = round(teacher_mb / student_mb, 2)
+
+    with open(os.path.join(student_dir, "distill_report.json"), "w", encoding="utf-8") as fp:
+        json.dump(report, fp, indent=4)
+
+    return report
+
+
+# Distills the fine-tuned LLM into a smaller student model and reports how it compares
+# The student is used the same way as the LLM, e.g. test_created_llm("./llm/student_llm")
+def create_student_llm(teacher_dir="./llm/best_llm", student_dir="./llm/student_llm", num_layers=2, dim=None, hidden_dim=None):
+    train_student(teacher_dir, student_dir, num_layers, dim, hidden_dim)
+    report = compare_student(teacher_dir, student_dir)
+    print(f"\nDistillation Results:\n{json.dumps(report, indent=4)}")
+    return student_dir
+
+
+if __name__ == "__main__":
+    create_student_llm()
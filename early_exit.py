@@ -0,0 +1,195 @@
+import json
+import os
+import time
+import polars as pl
+import torch
+import torch.nn.functional as F
+from fine_tune_llm import load_trained_model, get_accuracy
+
+
+# Raised inside the forward pass once an intermediate classifier head is confident enough
+# Stops the remaining transformer layers from running
+class EarlyExit(Exception):
+    def __init__(self, layer, probabilities):
+        super().__init__(layer)
+        self.layer = layer
+        self.probabilities = probabilities
+
+
+# Returns the [CLS] hidden state from the output of a transformer layer
+def cls_hidden_state(output):
+    hidden = output[0] if isinstance(output, tuple) else output
+    return hidden[:, 0]
+
+
+# Creates one linear classifier head for each intermediate transformer layer (the last layer uses the model's own classifier)
+def create_exit_heads(model):
+    return torch.nn.ModuleList([
+        torch.nn.Linear(model.config.dim, model.config.num_labels) for _ in range(model.config.n_layers - 1)
+    ])
+
+
+# Runs the full model over the sentences of a JSON file in batches
+# Returns the [CLS] hidden states of each intermediate layer, the final logits, and the labels
+def collect_features(tokenizer, model, json_file, max_sentences=None, batch_size=32):
+    data = pl.read_json(json_file)
+    if max_sentences is not None and len(data) > max_sentences:
+        data = data.sample(n=max_sentences, seed=42)
+    sentences = data["sentence"].to_list()
+
+    layer_features = [[] for _ in range(model.config.n_layers - 1)]
+    final_logits = []
+    for i in range(0, len(sentences), batch_size):
+        inputs = tokenizer(sentences[i : i + batch_size], return_tensors="pt", padding=True, truncation=True).to(model.device)
+        with torch.no_grad():
+            outputs = model(**inputs, output_hidden_states=True)
+
+        # hidden_states[0] is the embedding output and hidden_states[i] is the output of layer i
+        for layer, hidden in enumerate(outputs.hidden_states[1:-1]):
+            layer_features[layer].append(hidden[:, 0].cpu())
+        final_logits.append(outputs.logits.cpu())
+
+    features = [torch.cat(f) for f in layer_features]
+    return features, torch.cat(final_logits), torch.tensor(data["label"].to_list())
+
+
+# Trains the exit heads on the hidden states of the frozen model (the fine-tuned model itself is not changed)
+def train_exit_heads(heads, features, labels, num_epochs=3, batch_size=64, lr=1e-3):
+    optimizer = torch.optim.Adam(heads.parameters(), lr=lr)
+    heads.train()
+
+    for epoch in range(num_epochs):
+        permutation = torch.randperm(len(labels))
+        for i in range(0, len(labels), batch_size):
+            idx = permutation[i : i + batch_size]
+            loss = sum(F.cross_entropy(head(features[layer][idx]), labels[idx]) for layer, head in enumerate(heads))
+            optimizer.zero_grad()
+            loss.backward()
+            optimizer.step()
+
+    heads.eval()
+    return heads
+
+
+# Finds the temperature that best calibrates the logits (minimizes the negative log likelihood of the labels)
+def fit_temperature(logits, labels):
+    log_temperature = torch.zeros(1, requires_grad=True)
+    optimizer = torch.optim.LBFGS([log_temperature], lr=0.1, max_iter=50)
+
+    def closure():
+        optimizer.zero_grad()
+        loss = F.cross_entropy(logits / log_temperature.exp(), labels)
+        loss.backward()
+        return loss
+
+    optimizer.step(closure)
+    return log_temperature.exp().item()
+
+
+# Trains and calibrates exit heads for the fine-tuned model and saves them next to it
+# The heads are trained on (a subset of) the training data and calibrated on the validation data
+def create_exit_heads_for_model(model_dir="./llm/best_llm", max_train_sentences=10000):
+    tokenizer, model = load_trained_model(model_dir, "distilbert-base-uncased")
+    heads = create_exit_heads(model)
+
+    features, _, labels = collect_features(tokenizer, model, "./data/train_sva_data.json", max_train_sentences)
+    train_exit_heads(heads, features, labels)
+
+    # One temperature per head, plus one for the final classifier
+    features, final_logits, labels = collect_features(tokenizer, model, "./data/valid_sva_data.json")
+    temperatures = []
+    with torch.no_grad():
+        head_logits = [head(features[layer]) for layer, head in enumerate(heads)]
+    for logits in head_logits + [final_logits]:
+        temperatures.append(fit_temperature(logits, labels))
+
+    torch.save({"heads": heads.state_dict(), "temperatures": temperatures}, os.path.join(model_dir, "early_exit_heads.pt"))
+    return heads, temperatures
+
+
+# Loads the fine-tuned model with its trained exit heads
+def load_early_exit_model(model_dir="./llm/best_llm"):
+    tokenizer, model = load_trained_model(model_dir, "distilbert-base-uncased")
+    heads = create_exit_heads(model)
+    saved = torch.load(os.path.join(model_dir, "early_exit_heads.pt"), map_location=model.device)
+    heads.load_state_dict(saved["heads"])
+    heads.to(model.device).eval()
+    return tokenizer, model, heads, saved["temperatures"]
+
+
+# Predicts subject-verb agreement, stopping at the first layer whose head is at least threshold confident for every sentence
+# Returns the calibrated probability of each sentence being good (label 1) and the number of layers executed
+def predict_sva_early_exit(tokenizer, model, heads, temperatures, sentences, threshold=0.9):
+    inputs = tokenizer(list(sentences), return_tensors="pt", padding=True, truncation=True).to(model.device)
+
+    # Check the confidence of each intermediate head right after its layer runs
+    def make_hook(layer):
+        def hook(module, args, output):
+            probabilities = F.softmax(heads[layer](cls_hidden_state(output)) / temperatures[layer], dim=-1)
+            if (probabilities.max(dim=-1).values >= threshold).all():
+                raise EarlyExit(layer + 1, probabilities)
+        return hook
+
+    layers = model.distilbert.transformer.layer
+    handles = [layer.register_forward_hook(make_hook(i)) for i, layer in enumerate(layers[:-1])]
+    try:
+        with torch.no_grad():
+            logits = model(**inputs).logits
+        probabilities = F.softmax(logits / temperatures[-1], dim=-1)
+        layers_executed = len(layers)
+    except EarlyExit as early_exit:
+        probabilities = early_exit.probabilities
+        layers_executed = early_exit.layer
+    finally:
+        for handle in handles:
+            handle.remove()
+
+    return probabilities[:, 1].tolist(), layers_executed
+
+
+# Tests the early exit model on a JSON file one sentence at a time
+# Returns the accuracy, the average number of layers executed, and the average latency in milliseconds
+def test_early_exit(tokenizer, model, heads, temperatures, json_file, threshold):
+    data = pl.read_json(json_file)
+    list_gt = data["label"].to_list()
+
+    list_pred = []
+    total_layers = 0
+    start = time.perf_counter()
+    for sentence in data["sentence"].to_list():
+        probabilities, layers_executed = predict_sva_early_exit(tokenizer, model, heads, temperatures, [sentence], threshold)
+        list_pred.append(1 if probabilities[0] > 0.5 else 0)
+        total_layers += layers_executed
+    elapsed = time.perf_counter() - start
+
+    return get_accuracy(list_gt, list_pred), total_layers / len(list_gt), elapsed / len(list_gt) * 1000
+
+
+# Reports the accuracy/latency trade-off of several confidence thresholds on both test files
+# A threshold above 1 never exits early, which gives the full model as a baseline
+def evaluate_early_exit(model_dir="./llm/best_llm", thresholds=(0.8, 0.9, 0.95, 0.99, 1.01)):
+    tokenizer, model, heads, temperatures = load_early_exit_model(model_dir)
+
+    report = []
+    for file in ["./data/test_sva_data.json", "./data/test_real_data.json"]:
+        for threshold in thresholds:
+            accuracy, avg_layers, latency_ms = test_early_exit(tokenizer, model, heads, temperatures, file, threshold)
+            report.append({
+                "test_file": os.path.basename(file),
+                "threshold": threshold,
+                "accuracy": round(accuracy, 3),
+                "avg_layers": round(avg_layers, 2),
+                "latency_ms": round(latency_ms, 2),
+            })
+            print(f"{os.path.basename(file)} threshold={threshold}: accuracy {accuracy:.3f}, "
+                  f"{avg_layers:.2f} layers, {latency_ms:.2f} ms/sentence")
+
+    with open(os.path.join(model_dir, "early_exit_report.json"), "w", encoding="utf-8") as fp:
+        json.dump(report, fp, indent=4)
+
+    return report
+
+
+if __name__ == "__main__":
+    create_exit_heads_for_model()
+    evaluate_early_exit()
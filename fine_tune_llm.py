@@ -1,11 +1,15 @@
+import glob
 import json
 import os
+import time
 import numpy as np
 import pandas as pd
 import polars as pl
 import torch
-from datasets import Dataset, DatasetDict
-from transformers import AutoTokenizer, AutoModelForSequenceClassification, TrainingArguments, Trainer
+from datasets import Dataset, DatasetDict, load_dataset
+from transformers import AutoTokenizer, AutoModelForSequenceClassification, TrainingArguments, Trainer, TrainerCallback
+from transformers.trainer_utils import get_last_checkpoint
+from stream_data import iter_json_records, iter_batches
 
 
 # Loads model and tokenizer for classification
@@ -76,6 +80,66 @@ def train_model(model, train_dataset, valid_dataset, num_epochs, output_dir, bes
     print(f"\nEvaluation Results:\n{eval_results}")
 
 
+# Prints the training throughput (samples/sec) every time the Trainer logs
+class ThroughputCallback(TrainerCallback):
+    def on_train_begin(self, args, state, control, **kwargs):
+        self.last_time = time.perf_counter()
+        self.last_step = state.global_step
+
+    def on_log(self, args, state, control, logs=None, **kwargs):
+        now = time.perf_counter()
+        steps = state.global_step - self.last_step
+        if steps > 0:
+            samples = steps * args.per_device_train_batch_size * args.gradient_accumulation_steps * args.world_size
+            print(f"Step {state.global_step}/{state.max_steps}: {samples / (now - self.last_time):.1f} samples/sec")
+        self.last_time = now
+        self.last_step = state.global_step
+
+
+# Trains a model on a streamed training dataset for max_steps steps using the HuggingFace Trainer model
+# Checkpoints are saved every save_steps steps, and training resumes from the latest checkpoint in output_dir if there is one
+# output_dir should only hold the checkpoints of this run; the best model is saved to the bestmodel_dir path
+def train_model_streaming(model, train_dataset, valid_dataset, max_steps, save_steps, output_dir, bestmodel_dir):
+    training_args = TrainingArguments(
+        output_dir=output_dir,          # Directory to save the checkpoints
+        max_steps=max_steps,            # Total number of training steps (a stream has no epochs)
+        per_device_train_batch_size=8,  # Batch size for training
+        per_device_eval_batch_size=8,   # Batch size for evaluation
+        logging_steps=50,               # Log every 50 steps
+        eval_strategy="steps",          # Run evaluation every save_steps steps
+        eval_steps=save_steps,
+        save_strategy="steps",          # Save a checkpoint every save_steps steps
+        save_steps=save_steps,
+        save_total_limit=2,             # Keep the latest and the best checkpoints
+        load_best_model_at_end=True,    # Load the best model found during training
+    )
+
+    # Initialize Trainer
+    trainer = Trainer(
+        model=model,
+        args=training_args,
+        train_dataset=train_dataset,
+        eval_dataset=valid_dataset,
+        compute_metrics=compute_metrics,
+        callbacks=[ThroughputCallback()],
+    )
+
+    # Resume after an interruption if a checkpoint exists
+    checkpoint = get_last_checkpoint(output_dir) if os.path.isdir(output_dir) else None
+    if checkpoint:
+        print(f"Resuming from {checkpoint}")
+
+    # Start training
+    trainer.train(resume_from_checkpoint=checkpoint)
+
+    # Save the best performing model
+    trainer.save_model(bestmodel_dir)
+
+    # After training, get the final evaluation results
+    eval_results = trainer.evaluate()
+    print(f"\nEvaluation Results:\n{eval_results}")
+
+
 # Loads the trained model
 def load_trained_model(model_dir, model_name):
     tokenizer = AutoTokenizer.from_pretrained(model_name)
@@ -99,8 +163,41 @@ def predict_sva(tokenizer, loaded_model, sentence):
     return 1 if loaded_model.config.id2label[predicted_class_id] == "LABEL_1" else 0
 
 
-# Returns a subset of size train_size of the training data
-def decide_train_size(pd_train, train_size):
+# Predicts subject-verb agreement for a batch of sentences in a single forward pass
+# Returns a list with 1 for each good sentence or 0 for each sentence with an SVA error
+def predict_sva_batch(tokenizer, loaded_model, sentences):
+    # Tokenize the input texts (padded to the longest sentence in the batch)
+    inputs = tokenizer(list(sentences), return_tensors="pt", padding=True, truncation=True).to(loaded_model.device)
+
+    # Get model output
+    with torch.no_grad():
+        logits = loaded_model(**inputs).logits
+
+    # Get the predicted class ID of each sentence
+    predicted_class_ids = logits.argmax(dim=-1).tolist()
+
+    return [1 if loaded_model.config.id2label[class_id] == "LABEL_1" else 0 for class_id in predicted_class_ids]
+
+
+# Scores a batch of sentences in a single forward pass
+# Returns the probability of each sentence being good (label 1)
+def predict_sva_scores(tokenizer, loaded_model, sentences):
+    # Tokenize the input texts (padded to the longest sentence in the batch)
+    inputs = tokenizer(list(sentences), return_tensors="pt", padding=True, truncation=True).to(loaded_model.device)
+
+    # Get model output
+    with torch.no_grad():
+        logits = loaded_model(**inputs).logits
+
+    # Get the probability of the "correct" class
+    correct_id = loaded_model.config.label2id.get("LABEL_1", 1)
+    probabilities = torch.softmax(logits, dim=-1)[:, correct_id]
+
+    return probabilities.tolist()
+
+
+# Returns a subset of size train_size of the training data (random_state seeds the draw so it can be reproduced)
+def decide_train_size(pd_train, train_size, random_state=None):
     # Identify how many samples to get for each class
     classes = pd_train["label"].unique()
     num_classes = len(classes) # 2 classes in this case
@@ -111,14 +208,14 @@ def decide_train_size(pd_train, train_size):
     for c in classes:
         class_subset = pd_train[pd_train["label"] == c]
         num_class_samples = min(samples_per_class, len(class_subset))    
-        class_samples = class_subset.sample(num_class_samples)
+        class_samples = class_subset.sample(num_class_samples, random_state=random_state)
         total_samples.append(class_samples)
     pd_sampled_train = pd.concat(total_samples)
 
     # If the number of collected samples is not equal to the train_size, then randomly collect more samples
     if len(pd_sampled_train) < train_size:
         num_missing = train_size - len(pd_sampled_train)
-        pd_sampled_train = pd.concat([pd_sampled_train, pd_train.drop(pd_sampled_train.index).sample(n=num_missing)])
+        pd_sampled_train = pd.concat([pd_sampled_train, pd_train.drop(pd_sampled_train.index).sample(n=num_missing, random_state=random_state)])
 
     # Shuffle the samples
     pd_sampled_train = pd_sampled_train.sample(frac=1, random_state=42).reset_index(drop=True)
@@ -141,11 +238,60 @@ def get_accuracy(list_gt, list_pred):
     return accuracy
 
 
-# Tests the given model
-def test(model_name, model_dir, pl_data):
-    tokenizer, model = load_trained_model(model_dir, model_name)
-    pl_data = pl_data.with_columns(prediction = pl.col("sentence").map_elements(lambda x: predict_sva(tokenizer, model, x)))
-    return get_accuracy(pl_data["label"].to_list(), pl_data["prediction"].to_list())
+# Tests the given model on a JSON test file
+# The file is read incrementally and classified in batches of batch_size; only running counts are kept, so memory stays flat
+def test(model_name, model_dir, json_file, batch_size=32, loaded=None):
+    tokenizer, model = loaded or load_trained_model(model_dir, model_name)
+
+    total_predictions = 0
+    correct_predictions = 0
+    for batch in iter_batches(iter_json_records(json_file), batch_size):
+        predictions = predict_sva_batch(tokenizer, model, [entry["sentence"] for entry in batch])
+        for entry, prediction in zip(batch, predictions):
+            total_predictions += 1
+            if prediction == entry["label"]:
+                correct_predictions += 1
+
+    return correct_predictions / total_predictions
+
+
+# Returns True if the grammatical sentence (label 1) of the pair gets the higher "correct" score
+def is_pair_correct(pair, scores):
+    good_score = scores[0] if pair[0]["label"] == 1 else scores[1]
+    bad_score = scores[1] if pair[0]["label"] == 1 else scores[0]
+    return good_score > bad_score
+
+
+# Tests the given model on sentence pairs
+# Both sentences of each pair are classified in the same batch (pairs_per_batch pairs per forward pass)
+# Returns the pairwise accuracy and the sentence-level accuracy from the same forward passes (None for both if there are no pairs)
+# The pairs file is read incrementally and only running counts are kept
+def test_pairwise(model_name, model_dir, json_file, pairs_per_batch=16, loaded=None):
+    tokenizer, model = loaded or load_trained_model(model_dir, model_name)
+
+    total_pairs = 0
+    correct_pairs = 0
+    total_predictions = 0
+    correct_predictions = 0
+    for batch_pairs in iter_batches(iter_json_records(json_file), pairs_per_batch):
+        sentences = [entry["sentence"] for pair in batch_pairs for entry in pair]
+        scores = predict_sva_scores(tokenizer, model, sentences)
+
+        # Regroup the flat scores into their pairs
+        for k, pair in enumerate(batch_pairs):
+            pair_scores = scores[2 * k : 2 * k + 2]
+            total_pairs += 1
+            if is_pair_correct(pair, pair_scores):
+                correct_pairs += 1
+            for entry, score in zip(pair, pair_scores):
+                total_predictions += 1
+                if (1 if score > 0.5 else 0) == entry["label"]:
+                    correct_predictions += 1
+
+    if total_pairs == 0:
+        print("No pairs to test")
+        return None, None
+    return correct_pairs / total_pairs, correct_predictions / total_predictions
 
 
 # Creates an LLM for SVA classification
@@ -185,13 +331,70 @@ def create_llm():
     return model_dir
 
 
+# Writes the sentences of a training JSON file to JSON Lines shards of shard_size sentences each
+# Returns the list of shard files
+# The JSON file is read incrementally, so only one shard is held in memory at a time
+def shard_training_data(json_file, shard_dir, shard_size=100000):
+    os.makedirs(shard_dir, exist_ok=True)
+
+    shard_files = []
+    for i, shard in enumerate(iter_batches(iter_json_records(json_file), shard_size)):
+        shard_file = os.path.join(shard_dir, f"train_{i:05d}.jsonl")
+        with open(shard_file, "w", encoding="utf-8") as fp:
+            for entry in shard:
+                fp.write(json.dumps(entry) + "\n")
+        shard_files.append(shard_file)
+
+    return shard_files
+
+
+# Returns a lazily read, shuffled, and tokenized stream of the sentences in the JSON Lines shard files
+# Only shuffle_buffer sentences are held in memory at a time
+def load_streaming_dataset(tokenizer, shard_files, shuffle_buffer=10000, seed=42):
+    stream = load_dataset("json", data_files=shard_files, split="train", streaming=True)
+    stream = stream.shuffle(seed=seed, buffer_size=shuffle_buffer)
+    return stream.map(lambda x: tokenize_function(tokenizer, x), batched=True, remove_columns=["sentence"])
+
+
+# Creates an LLM for SVA classification by streaming the training data from JSON Lines shards
+# Trains for max_steps steps so the training corpus never has to fit in memory, and resumes from the latest checkpoint in ./llm/streaming
+def create_llm_streaming(shard_pattern="./data/train_shards/*.jsonl", max_steps=10000, save_steps=500):
+    # Shard the training data if no shards exist yet
+    shard_files = sorted(glob.glob(shard_pattern))
+    if not shard_files:
+        shard_files = shard_training_data("./data/train_sva_data.json", os.path.dirname(shard_pattern))
+
+    # Load model and tokenizer
+    tokenizer, model = load_model_and_tokenizer()
+
+    # Stream the training data; the validation data is small enough to load
+    train_dataset = load_streaming_dataset(tokenizer, shard_files)
+    valid_dataset = Dataset.from_pandas(pl.read_json("./data/valid_sva_data.json").to_pandas())
+    valid_dataset = valid_dataset.map(lambda x: tokenize_function(tokenizer, x), batched=True)
+
+    # Train the model
+    # The checkpoints go to their own directory so they are not mixed up with the checkpoints of create_llm
+    train_model_streaming(model, train_dataset, valid_dataset, max_steps, save_steps, "./llm/streaming", "./llm/best_llm")
+
+    model_dir = "./llm/best_llm"
+    return model_dir
+
+
 # Tests the created LLM on the testing data from the extracted and generated SVA sentences
 # Also separately tests on the complex, real-world sentences
-def test_created_llm(model_dir="./llm/best_llm"):
+# An already loaded (tokenizer, model) can be passed so the LLM is not loaded again for each test
+def test_created_llm(model_dir="./llm/best_llm", loaded=None):
     test_accuracies = []
     for file in ["./data/test_sva_data.json", "./data/test_real_data.json"]:
-        pl_test = pl.read_json(file)
-        model_dir = model_dir
-        test_accuracy = round(test("distilbert-base-uncased", model_dir, pl_test), 3)
+        test_accuracy = round(test("distilbert-base-uncased", model_dir, file, loaded=loaded), 3)
         test_accuracies.append(test_accuracy)
     return test_accuracies
+
+
+# Tests the created LLM on the test pairs (both sentences of each pair)
+# Returns the pairwise accuracy and the sentence-level accuracy
+def test_created_llm_pairwise(model_dir="./llm/best_llm", json_file="./data/test_sva_pairs.json", loaded=None):
+    pairwise_accuracy, accuracy = test_pairwise("distilbert-base-uncased", model_dir, json_file, loaded=loaded)
+    if pairwise_accuracy is None:
+        return None, None
+    return round(pairwise_accuracy, 3), round(accuracy, 3)
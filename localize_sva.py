@@ -0,0 +1,201 @@
+import difflib
+import json
+import os
+import torch
+from datasets import Dataset
+from transformers import (
+    AutoTokenizer, AutoModelForTokenClassification, DataCollatorForTokenClassification, TrainingArguments, Trainer
+)
+from fine_tune_llm import get_accuracy
+
+
+# Returns the positions of the tokens in the incorrect sentence that differ from the correct sentence (the SVA error)
+# The sentences in a pair only differ by the SVA edit, so the differing tokens are the offending verb(s)
+def error_token_positions(incorrect_tokens, correct_tokens):
+    positions = set()
+    matcher = difflib.SequenceMatcher(a=incorrect_tokens, b=correct_tokens, autojunk=False)
+    for tag, i1, i2, _, _ in matcher.get_opcodes():
+        if tag == "equal":
+            continue
+        if i1 == i2 and incorrect_tokens:
+            # An inserted token is attributed to the token it is inserted before
+            positions.add(min(i1, len(incorrect_tokens) - 1))
+        positions.update(range(i1, i2))
+    return positions
+
+
+# Returns token-tagged examples for a list of sentence pairs
+# Tokens of the SVA error in the incorrect sentence are tagged 1; every other token is tagged 0
+def tag_pairs(pairs):
+    examples = []
+    for pair in pairs:
+        labels = sorted(entry["label"] for entry in pair)
+        if labels != [0, 1]:
+            continue
+        incorrect = pair[0] if pair[0]["label"] == 0 else pair[1]
+        correct = pair[1] if pair[0]["label"] == 0 else pair[0]
+
+        incorrect_tokens = incorrect["sentence"].split()
+        correct_tokens = correct["sentence"].split()
+        positions = error_token_positions(incorrect_tokens, correct_tokens)
+
+        examples.append({"tokens": incorrect_tokens, "tags": [1 if i in positions else 0 for i in range(len(incorrect_tokens))]})
+        examples.append({"tokens": correct_tokens, "tags": [0] * len(correct_tokens)})
+    return examples
+
+
+# Returns the sentence pairs of a training JSON file (both sentences of each training pair are written next to each other)
+def load_train_pairs(json_file):
+    with open(json_file, "r", encoding="utf-8") as fp:
+        data = json.load(fp)
+    return [data[i : i + 2] for i in range(0, len(data) - 1, 2)]
+
+
+# Tokenizes the words of each example and aligns the tags with the subword tokens
+# Only the first subword of a word keeps its tag; the others (and special tokens) are ignored with -100
+def tokenize_and_align_tags(tokenizer, examples):
+    tokenized = tokenizer(examples["tokens"], is_split_into_words=True, truncation=True)
+
+    all_labels = []
+    for i, tags in enumerate(examples["tags"]):
+        labels = []
+        previous_word = None
+        for word_id in tokenized.word_ids(batch_index=i):
+            if word_id is None or word_id == previous_word:
+                labels.append(-100)
+            else:
+                labels.append(tags[word_id])
+            previous_word = word_id
+        all_labels.append(labels)
+
+    tokenized["labels"] = all_labels
+    return tokenized
+
+
+# Creates a token classification model that flags the verb positions of SVA errors
+# Trained on the tagged training pairs; validated on the validation pairs if the data was configured with the pairs kept
+def create_localizer(output_dir="./llm/localizer", bestmodel_dir="best_localizer", num_epochs=1):
+    tokenizer = AutoTokenizer.from_pretrained("distilbert-base-uncased")
+    model = AutoModelForTokenClassification.from_pretrained("distilbert-base-uncased", num_labels=2)
+
+    tokenize = lambda x: tokenize_and_align_tags(tokenizer, x)
+    train_dataset = Dataset.from_list(tag_pairs(load_train_pairs("./data/train_sva_data.json")))
+    train_dataset = train_dataset.map(tokenize, batched=True, remove_columns=["tokens", "tags"])
+
+    valid_dataset = None
+    if os.path.exists("./data/valid_sva_pairs.json"):
+        with open("./data/valid_sva_pairs.json", "r", encoding="utf-8") as fp:
+            valid_dataset = Dataset.from_list(tag_pairs(json.load(fp)))
+        valid_dataset = valid_dataset.map(tokenize, batched=True, remove_columns=["tokens", "tags"])
+
+    training_args = TrainingArguments(
+        output_dir=output_dir,                                   # Directory to save the model
+        num_train_epochs=num_epochs,                             # Total number of training epochs
+        per_device_train_batch_size=8,                           # Batch size for training
+        per_device_eval_batch_size=8,                            # Batch size for evaluation
+        logging_steps=50,                                        # Log every 50 steps
+        eval_strategy="epoch" if valid_dataset else "no",        # Run evaluation at the end of each epoch
+        save_strategy="epoch",                                   # Save the model at the end of each epoch
+        load_best_model_at_end=valid_dataset is not None,        # Load the best model found during training
+    )
+
+    trainer = Trainer(
+        model=model,
+        args=training_args,
+        train_dataset=train_dataset,
+        eval_dataset=valid_dataset,
+        data_collator=DataCollatorForTokenClassification(tokenizer),
+    )
+    trainer.train()
+
+    model_dir = os.path.join(output_dir, bestmodel_dir)
+    trainer.save_model(model_dir)
+    return model_dir
+
+
+# Loads the trained localizer
+def load_localizer(model_dir="./llm/localizer/best_localizer"):
+    tokenizer = AutoTokenizer.from_pretrained("distilbert-base-uncased")
+    model = AutoModelForTokenClassification.from_pretrained(model_dir)
+    return tokenizer, model
+
+
+# Finds the words of a whole document (e.g. a paragraph) that are likely part of an SVA error
+# The document is split into overlapping windows of max_length tokens, and all windows run in one batched forward pass
+# Returns the error probability of each word and the number of windows used
+def localize_sva(tokenizer, model, document, max_length=512, stride=128):
+    words = document.split()
+    if not words:
+        return [], 0
+
+    inputs = tokenizer(
+        words, is_split_into_words=True, truncation=True, max_length=max_length, stride=stride,
+        return_overflowing_tokens=True, padding=True, return_tensors="pt",
+    )
+    num_windows = inputs["input_ids"].shape[0]
+    model_inputs = {k: v.to(model.device) for k, v in inputs.items() if k in ("input_ids", "attention_mask")}
+
+    with torch.no_grad():
+        probabilities = torch.softmax(model(**model_inputs).logits, dim=-1)[:, :, 1].cpu()
+
+    # Each word takes its highest first-subword probability over the windows that contain it
+    word_probabilities = [0.0] * len(words)
+    for window in range(num_windows):
+        previous_word = None
+        for position, word_id in enumerate(inputs.word_ids(batch_index=window)):
+            if word_id is not None and word_id != previous_word:
+                word_probabilities[word_id] = max(word_probabilities[word_id], probabilities[window, position].item())
+            previous_word = word_id
+
+    return word_probabilities, num_windows
+
+
+# Returns the (index, word) of each word in the document flagged as an SVA error
+def flag_sva_errors(tokenizer, model, document, threshold=0.5):
+    word_probabilities, _ = localize_sva(tokenizer, model, document)
+    words = document.split()
+    return [(i, words[i]) for i, p in enumerate(word_probabilities) if p > threshold]
+
+
+# Tests the localizer on a JSON file by joining sentences_per_document sentences into one document
+# A sentence is predicted to have an SVA error (0) if any of its words are flagged
+# Returns the sentence-level accuracy and the average number of forward pass windows per document
+def test_localizer(tokenizer, model, json_file, sentences_per_document=20, threshold=0.5):
+    with open(json_file, "r", encoding="utf-8") as fp:
+        data = json.load(fp)
+
+    list_gt = []
+    list_pred = []
+    total_windows = 0
+    num_documents = 0
+    for i in range(0, len(data), sentences_per_document):
+        entries = data[i : i + sentences_per_document]
+        word_probabilities, num_windows = localize_sva(tokenizer, model, " ".join(e["sentence"] for e in entries))
+        total_windows += num_windows
+        num_documents += 1
+
+        # Map the words of the document back to their sentences
+        start = 0
+        for entry in entries:
+            end = start + len(entry["sentence"].split())
+            flagged = any(p > threshold for p in word_probabilities[start:end])
+            list_gt.append(entry["label"])
+            list_pred.append(0 if flagged else 1)
+            start = end
+
+    return get_accuracy(list_gt, list_pred), total_windows / num_documents
+
+
+# Tests the created localizer on the testing data from the extracted and generated SVA sentences
+# Also separately tests on the complex, real-world sentences
+def test_created_localizer(model_dir="./llm/localizer/best_localizer"):
+    tokenizer, model = load_localizer(model_dir)
+    test_accuracies = []
+    for file in ["./data/test_sva_data.json", "./data/test_real_data.json"]:
+        test_accuracy, windows_per_document = test_localizer(tokenizer, model, file)
+        test_accuracies.append([round(test_accuracy, 3), round(windows_per_document, 2)])
+    return test_accuracies
+
+
+if __name__ == "__main__":
+    print(test_created_localizer(create_localizer()))
@@ -1,18 +1,28 @@
-print("This may take a while...")
-print()
+# Worker processes (e.g. the sentence splitting workers) re-import this file, so only the main process loads the dependencies
+if __name__ == "__main__":
+    print("This may take a while...")
+    print()
 
 
-print("Preparing dependencies...")
-import sys
-from pathlib import Path
-from configure_data import configure_data
-from fine_tune_llm import create_llm, test_created_llm
-from parser import create_parser, test_created_parser
-print("Dependencies ready!")
-print()
+    print("Preparing dependencies...")
+    import sys
+    from pathlib import Path
+    from configure_data import configure_data
+    from fine_tune_llm import create_llm, load_trained_model, test_created_llm, test_created_llm_pairwise
+    from parser import create_parser, test_created_parser, test_created_parser_pairwise
+    from resources import load_resource_config, configure_threads, report_rss, release_memory
+    print("Dependencies ready!")
+    print()
 
 
 def main(seed):
+    # Set the thread counts of each backend before any model runs
+    config = load_resource_config()
+    configure_threads(config)
+    report_rss("startup")
+
+    print()
+
     configured_data = [
         "./data/test_real_data.json", "./data/test_sva_data.json", 
         "./data/train_sva_data.json", "./data/valid_sva_data.json"
@@ -25,7 +35,7 @@ def main(seed):
     # Configure the data if it has not been configured yet
     if not all_exist:
         print("Configuring data...")
-        configure_data(seed)
+        configure_data(seed, keep_pairs=True)
         print("Data ready!")
     else:
         print("Data already configured!")
@@ -46,43 +56,99 @@ def main(seed):
     if not all_exist:
         print("Fine-tuning LLM...")
         model_dir = create_llm()
+        release_memory()
         print("LLM ready!")
+        report_rss("fine-tuning LLM")
     else:
         print("LLM already fine-tuned!")
 
     print()
 
-    print("Loading parser...")
-    nlp = create_parser()
-    print("Parser ready!")
+    # Load and test the LLM and the parser one after the other
+    # Each model is freed before the next one is loaded, so they do not need memory at the same time, unless the models should be kept
+    stages = [("LLM", load_llm, run_llm_stage), ("Parser", load_parser, run_parser_stage)]
+    if config["parser_first"]:
+        stages.reverse()
+    results = {}
+    kept_models = []
+    for name, load_stage_model, run_stage in stages:
+        print(f"Loading {name}...")
+        model = load_stage_model(model_dir)
+        print(f"{name} ready!")
+        report_rss(f"loading {name}")
+
+        print()
+
+        results.update(run_stage(model_dir, model))
+        if config["free_models"]:
+            del model
+            release_memory()
+        else:
+            kept_models.append(model)
+        report_rss(f"testing {name}")
+
+        print()
+
+    print(f"Results:")
+    print(f"  Extracted/Generated:")
+    print(f"    LLM:               {results['accuracy_llm']}")
+    print(f"    Parser:            {results['accuracy_parser']}")
+    print(f"      Couldn't parse:  {results['not_parsed']}")
+    print(f"  Real-World:")
+    print(f"    LLM:               {results['accuracy_llm_real_world']}")
+    print(f"    Parser:            {results['accuracy_parser_real_world']}")
+    print(f"      Couldn't parse:  {results['not_parsed_real_world']}")
+
+    # Pairwise evaluation is only possible if the data was configured with the pairs kept
+    if "pairwise_llm" in results:
+        print()
+
+        print(f"Pairwise Results:")
+        print(f"  Extracted/Generated Pairs:")
+        print(f"    LLM:               {results['pairwise_llm']}")
+        print(f"      Per sentence:    {results['accuracy_llm_pairs']}")
+        print(f"    Parser:            {results['pairwise_parser']}")
+        print(f"      Couldn't parse:  {results['not_parsed_pairs']}")
 
-    print()
+
+# Loads the fine-tuned LLM; returns the tokenizer and the model
+def load_llm(model_dir):
+    return load_trained_model(model_dir, "distilbert-base-uncased")
+
+
+# Loads the parser
+def load_parser(model_dir):
+    return create_parser()
+
+
+# Tests the loaded LLM
+def run_llm_stage(model_dir, llm):
+    results = {}
 
     print("Testing LLM...")
-    results_llm = test_created_llm(model_dir)
-    accuracy_llm = results_llm[0]
-    accuracy_llm_real_world = results_llm[1]
+    results_llm = test_created_llm(model_dir, loaded=llm)
+    results["accuracy_llm"] = results_llm[0]
+    results["accuracy_llm_real_world"] = results_llm[1]
+    if Path("./data/test_sva_pairs.json").exists():
+        results["pairwise_llm"], results["accuracy_llm_pairs"] = test_created_llm_pairwise(model_dir, loaded=llm)
     print("Done!")
 
-    print()
+    return results
+
+
+# Tests the loaded parser
+def run_parser_stage(model_dir, nlp):
+    results = {}
 
     print("Testing parser...")
     results_parser = test_created_parser(nlp)
-    [accuracy_parser, not_parsed] = results_parser[0]
-    [accuracy_parser_real_world, not_parsed_real_world] = results_parser[1]
+    [results["accuracy_parser"], results["not_parsed"]] = results_parser[0]
+    [results["accuracy_parser_real_world"], results["not_parsed_real_world"]] = results_parser[1]
+    if Path("./data/test_sva_pairs.json").exists():
+        results["pairwise_parser"], results["not_parsed_pairs"] = test_created_parser_pairwise(nlp)
     print("Done!")
 
-    print()
-
-    print(f"Results:")
-    print(f"  Extracted/Generated:")
-    print(f"    LLM:               {accuracy_llm}")
-    print(f"    Parser:            {accuracy_parser}")
-    print(f"      Couldn't parse:  {not_parsed}")
-    print(f"  Real-World:")
-    print(f"    LLM:               {accuracy_llm_real_world}")
-    print(f"    Parser:            {accuracy_parser_real_world}")
-    print(f"      Couldn't parse:  {not_parsed_real_world}")
+    return results
     
 
 if __name__ == "__main__":
@@ -1,12 +1,13 @@
 from collections import defaultdict
 import os
-import json
 import subprocess
 import sys
 import spacy
 import lemminflect
 import benepar
 import inflect
+from stream_data import iter_json_records, iter_batches
+import sva_matcher  # registers the "sva_matcher" pipeline component
 
 
 # Loads model for classification
@@ -53,6 +54,18 @@ def subjects_for_verb(verb):
 # Allows multiple occurrences of the same verb with different subjects
 def parse_sentence(nlp, sentence):
     doc = nlp(sentence)
+    return parse_doc(doc, sentence)
+
+
+# Extracts auxiliaries (or main verbs if no auxiliaries) and their corresponding subjects from sentences in batches
+# Uses nlp.pipe so spaCy can process the batch together; yields the results of each sentence in order
+def parse_sentences(nlp, sentences, batch_size=32):
+    for sentence, doc in zip(sentences, nlp.pipe(sentences, batch_size=batch_size)):
+        yield parse_doc(doc, sentence)
+
+
+# Extracts auxiliaries (or main verbs if no auxiliaries) and their corresponding subjects from an already processed doc
+def parse_doc(doc, sentence):
     results = []
 
     for sent in doc.sents:
@@ -74,6 +87,14 @@ def parse_sentence(nlp, sentence):
     return results
 
 
+# Combines all verb_subject_maps in case there are multiple sentences returned
+def merge_verb_subject_maps(sentence_results):
+    verb_subject_map = defaultdict(list)
+    for res in sentence_results:
+        for verb, subject_lists in res["verb_subject_map"].items():
+            verb_subject_map[verb].extend(subject_lists)
+    return dict(verb_subject_map)
+
 
 # Predicts subject-verb agreement in a given sentence mapping
 # Returns 1 if the sentence is good, 0 if there is an SVA error, or -1 if the sentence could not be parsed (empty mapping input)
@@ -123,55 +144,124 @@ def predict_sva(nlp, verb_subject_map):
     return 1 
 
 
+# Returns empty running counts of predictions for calculating accuracy incrementally
+def new_accuracy_counts():
+    return {"total_predictions": 0, "correct_predictions": 0, "no_predictions": 0}
+
+
+# Updates the running counts with one ground truth and predicted label
+def update_accuracy_counts(counts, gt, pred):
+    if pred == -1:
+        counts["no_predictions"] += 1
+    else:
+        counts["total_predictions"] += 1
+    if pred == gt:
+        counts["correct_predictions"] += 1
+
+
+# Calculates accuracy from the running counts
+# Also returns the distribution of sentences that could not be parsed
+def accuracy_from_counts(counts):
+    accuracy = counts["correct_predictions"] / counts["total_predictions"]
+    not_parsed = counts["no_predictions"] / counts["total_predictions"]
+
+    return accuracy, not_parsed
+
+
 # Calculates accuracy from the given ground truth and predicted labels
 # Also returns the distribution of sentences that could not be parsed
 def get_accuracy(list_gt, list_pred):
-    total_predictions = 0
-    correct_predictions = 0
-    no_predictions = 0
+    counts = new_accuracy_counts()
 
     for i in range(len(list_pred)):
-        if list_pred[i] == -1:
-            no_predictions += 1
-        else:
-            total_predictions += 1
-        if list_pred[i] == list_gt[i]:
-            correct_predictions += 1
-
-    accuracy = correct_predictions / total_predictions
-    not_parsed = no_predictions / total_predictions
+        update_accuracy_counts(counts, list_gt[i], list_pred[i])
 
-    return accuracy, not_parsed 
+    return accuracy_from_counts(counts)
 
 
 # Tests the model
-def test(nlp, json_file):
-    with open(json_file, "r", encoding="utf-8") as fp:
-        data = json.load(fp)
-
-    list_gt = []
-    list_pred = []
+# The test file is read incrementally and the accuracy is updated per batch, so memory stays flat for any test set size
+def test(nlp, json_file, batch_size=32):
+    counts = new_accuracy_counts()
+
+    for batch in iter_batches(iter_json_records(json_file), batch_size):
+        sentences = [entry["sentence"] for entry in batch]
+
+        # Parse the sentences to get verb_subject_maps
+        for entry, sentence_results in zip(batch, parse_sentences(nlp, sentences, batch_size)):
+            label = entry.get("label", "")
+
+            # Combine all verb_subject_maps in case there are multiple sentences returned
+            verb_subject_map = merge_verb_subject_maps(sentence_results)
+
+            # Predict SVA using the verb_subject_map
+            prediction = predict_sva(nlp, verb_subject_map)
+
+            update_accuracy_counts(counts, label, prediction)
+
+    return accuracy_from_counts(counts)
+
+
+# Tests the model on sentence pairs; both sentences of each pair are parsed in the same nlp.pipe batch
+# A pair is counted as correct if the grammatical sentence (label 1) is predicted 1 and the other sentence 0
+# Pairs where either sentence could not be parsed (-1) are left out of the accuracy and counted separately
+# Returns the pairwise accuracy and the distribution of pairs that could not be parsed (None for both if no pair could be parsed)
+def test_pairwise(nlp, json_file):
+    correct_pairs = 0
+    num_pairs = 0
+    no_prediction_pairs = 0
+
+    for pair in iter_json_records(json_file):
+        sentences = [entry["sentence"] for entry in pair]
+        predictions = [
+            predict_sva(nlp, merge_verb_subject_maps(results))
+            for results in parse_sentences(nlp, sentences, batch_size=2)
+        ]
+        if -1 in predictions:
+            no_prediction_pairs += 1
+            continue
+
+        num_pairs += 1
+        good_prediction = predictions[0] if pair[0]["label"] == 1 else predictions[1]
+        bad_prediction = predictions[1] if pair[0]["label"] == 1 else predictions[0]
+        if good_prediction > bad_prediction:
+            correct_pairs += 1
+
+    if num_pairs == 0:
+        print("No parseable pairs")
+        return None, None
+    return correct_pairs / num_pairs, no_prediction_pairs / num_pairs
+
+
+# Adds the rule-compiled SVA checker to the end of the pipeline if missing
+def add_sva_matcher(nlp):
+    if "sva_matcher" not in nlp.pipe_names:
+        nlp.add_pipe("sva_matcher", last=True)
+    return nlp
 
-    for entry in data:
-        sentence = entry["sentence"]
-        label = entry.get("label", "")
 
-        # Parse the sentence to get verb_subject_map
-        sentence_results = parse_sentence(nlp, sentence)
+# Predicts subject-verb agreement for sentences in batches with the rule-compiled checker
+# Only the dependency parse is needed, so benepar and the entity recognizer are skipped
+# Yields 1 for each good sentence, 0 for each sentence with an SVA error, or -1 if nothing could be checked
+def predict_sva_fast(nlp, sentences, batch_size=64):
+    add_sva_matcher(nlp)
+    disabled = [pipe for pipe in ("benepar", "ner") if pipe in nlp.pipe_names]
+    with nlp.select_pipes(disable=disabled):
+        for doc in nlp.pipe(sentences, batch_size=batch_size):
+            yield doc._.sva
 
-        # Combine all verb_subject_maps in case there are multiple sentences returned
-        verb_subject_map = defaultdict(list)
-        for res in sentence_results:
-            for verb, subject_lists in res["verb_subject_map"].items():
-                verb_subject_map[verb].extend(subject_lists)
 
-        # Predict SVA using the verb_subject_map
-        prediction = predict_sva(nlp, dict(verb_subject_map))
+# Tests the rule-compiled checker
+# The test file is read incrementally and the accuracy is updated per batch
+def test_fast(nlp, json_file, batch_size=64):
+    counts = new_accuracy_counts()
 
-        list_gt.append(label)
-        list_pred.append(prediction)
+    for batch in iter_batches(iter_json_records(json_file), batch_size):
+        predictions = predict_sva_fast(nlp, [entry["sentence"] for entry in batch], batch_size)
+        for entry, prediction in zip(batch, predictions):
+            update_accuracy_counts(counts, entry.get("label", ""), prediction)
 
-    return get_accuracy(list_gt, list_pred)
+    return accuracy_from_counts(counts)
 
 
 # Creates a parser model for SVA classification
@@ -188,3 +278,21 @@ def test_created_parser(nlp):
         test_accuracy, not_parsed = test(nlp, file)
         test_accuracies.append([round(test_accuracy, 3), round(not_parsed, 3)])
     return test_accuracies
+
+
+# Tests the created parser model on the test pairs (both sentences of each pair)
+# Returns the pairwise accuracy and the distribution of pairs that could not be parsed
+def test_created_parser_pairwise(nlp, json_file="./data/test_sva_pairs.json"):
+    pairwise_accuracy, not_parsed = test_pairwise(nlp, json_file)
+    if pairwise_accuracy is None:
+        return None, None
+    return round(pairwise_accuracy, 3), round(not_parsed, 3)
+
+
+# Tests the rule-compiled checker on the same test files as the parser
+def test_created_parser_fast(nlp):
+    test_accuracies = []
+    for file in ["./data/test_sva_data.json", "./data/test_real_data.json"]:
+        test_accuracy, not_parsed = test_fast(nlp, file)
+        test_accuracies.append([round(test_accuracy, 3), round(not_parsed, 3)])
+    return test_accuracies
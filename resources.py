@@ -0,0 +1,77 @@
+import gc
+import importlib.util
+import os
+import psutil
+import torch
+from threadpoolctl import threadpool_limits
+
+
+# Keeps the BLAS thread limit applied for the rest of the process
+blas_limits = None
+
+
+# Returns the integer value of an environment variable, or None if it is not set
+def env_int(name):
+    value = os.environ.get(name)
+    return int(value) if value else None
+
+
+# Reads the resource settings from environment variables (an unset thread count keeps the library default)
+#   SVA_TORCH_THREADS / SVA_TORCH_INTEROP_THREADS: PyTorch intra-op / inter-op threads (DistilBERT and Benepar)
+#   SVA_TF_THREADS / SVA_TF_INTEROP_THREADS: TensorFlow intra-op / inter-op threads (only if TensorFlow is installed)
+#   SVA_BLAS_THREADS: BLAS/OpenMP threads (spaCy and NumPy)
+#   SVA_FREE_MODELS: 1 (default) frees each model before the next one is loaded, 0 keeps both loaded until the end of the run
+#   SVA_PARSER_FIRST: 1 runs the parser stage before the LLM stage, 0 (default) runs the LLM first
+def load_resource_config():
+    return {
+        "torch_intra_op_threads": env_int("SVA_TORCH_THREADS"),
+        "torch_inter_op_threads": env_int("SVA_TORCH_INTEROP_THREADS"),
+        "tf_intra_op_threads": env_int("SVA_TF_THREADS"),
+        "tf_inter_op_threads": env_int("SVA_TF_INTEROP_THREADS"),
+        "blas_threads": env_int("SVA_BLAS_THREADS"),
+        "free_models": os.environ.get("SVA_FREE_MODELS", "1") != "0",
+        "parser_first": os.environ.get("SVA_PARSER_FIRST", "0") == "1",
+    }
+
+
+# Applies the thread counts of each backend
+# Must be called before any model runs, since the inter-op thread pools cannot be changed once they are used
+def configure_threads(config):
+    global blas_limits
+
+    if config["torch_intra_op_threads"]:
+        torch.set_num_threads(config["torch_intra_op_threads"])
+    if config["torch_inter_op_threads"]:
+        try:
+            torch.set_num_interop_threads(config["torch_inter_op_threads"])
+        except RuntimeError:
+            print("Could not set the PyTorch inter-op threads (the thread pool is already in use)")
+
+    if (config["tf_intra_op_threads"] or config["tf_inter_op_threads"]) and importlib.util.find_spec("tensorflow"):
+        import tensorflow as tf
+        if config["tf_intra_op_threads"]:
+            tf.config.threading.set_intra_op_parallelism_threads(config["tf_intra_op_threads"])
+        if config["tf_inter_op_threads"]:
+            tf.config.threading.set_inter_op_parallelism_threads(config["tf_inter_op_threads"])
+
+    if config["blas_threads"]:
+        blas_limits = threadpool_limits(limits=config["blas_threads"])
+
+
+# Returns the resident set size of this process in MB
+def rss_mb():
+    return psutil.Process().memory_info().rss / 1024 / 1024
+
+
+# Prints and returns the resident set size of this process after a stage
+def report_rss(stage):
+    rss = rss_mb()
+    print(f"RSS after {stage}: {rss:.0f} MB")
+    return rss
+
+
+# Releases the memory of models that are no longer referenced
+def release_memory():
+    gc.collect()
+    if torch.cuda.is_available():
+        torch.cuda.empty_cache()
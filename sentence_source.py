@@ -0,0 +1,98 @@
+import glob
+import multiprocessing
+import os
+import re
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+
+# Splits a block of text into sentences and keeps the ones that are over min_words words long
+def split_long_sentences(text, min_words=35):
+    sentences = []
+
+    # Delete newlines so each sentence can be put on its own line later
+    for sentence in re.split(r'[.!?]', text.replace("\n", " ")):
+        sentence = sentence.strip()
+        if len(sentence.split()) > min_words:
+            sentences.append(sentence)
+
+    return sentences
+
+
+# Yields blocks of about block_size characters from the text files, each ending at a sentence boundary
+# The unfinished sentence at the end of a read is carried into the next block, so no sentence is cut in two
+def iter_text_blocks(filenames, block_size=1 << 20):
+    for filename in filenames:
+        carry = ""
+        with open(filename, "r", encoding="utf-8") as fp:
+            while True:
+                chunk = fp.read(block_size)
+                if not chunk:
+                    break
+                text = carry + chunk
+                last_end = max(text.rfind("."), text.rfind("!"), text.rfind("?"))
+                if last_end == -1:
+                    carry = text
+                    continue
+                yield text[: last_end + 1]
+                carry = text[last_end + 1 :]
+
+        # Sentences never continue into the next file
+        if carry:
+            yield carry
+
+
+# Writes one chunk of sentences to its own file (one sentence per line) and returns the file name
+def write_chunk(out_dir, index, sentences):
+    chunk_file = os.path.join(out_dir, f"candidates_{index:05d}.txt")
+    with open(chunk_file, "w", encoding="utf-8") as fp:
+        for sentence in sentences:
+            fp.write(sentence + "\n")
+    return chunk_file
+
+
+# Reads the text files incrementally and splits them into sentences in parallel worker processes
+# Keeps the sentences over min_words words long and writes them to chunk files of chunk_size sentences in out_dir
+# Returns the list of chunk files (in the order of the text files)
+def write_sentence_candidates(filenames, out_dir, min_words=35, workers=None, chunk_size=10000, block_size=1 << 20):
+    os.makedirs(out_dir, exist_ok=True)
+    for old_file in glob.glob(os.path.join(out_dir, "candidates_*.txt")):
+        os.remove(old_file)
+
+    workers = workers or os.cpu_count() or 1
+    chunk_files = []
+    sentences = []
+
+    # Spawned workers start a fresh interpreter; forking a process that already runs threads (PyTorch, LanguageTool) can deadlock
+    # Spawned workers re-import the calling script, so it must keep its work under an 'if __name__ == "__main__"' guard
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context) as executor:
+        # Limit the blocks in flight so only a few blocks are in memory at a time
+        pending = deque()
+        for block in iter_text_blocks(filenames, block_size):
+            pending.append(executor.submit(split_long_sentences, block, min_words))
+            if len(pending) >= 2 * workers:
+                sentences.extend(pending.popleft().result())
+
+            while len(sentences) >= chunk_size:
+                chunk_files.append(write_chunk(out_dir, len(chunk_files), sentences[:chunk_size]))
+                sentences = sentences[chunk_size:]
+
+        while pending:
+            sentences.extend(pending.popleft().result())
+
+    while sentences:
+        chunk_files.append(write_chunk(out_dir, len(chunk_files), sentences[:chunk_size]))
+        sentences = sentences[chunk_size:]
+
+    return chunk_files
+
+
+# Yields the sentences from the chunk files one at a time
+def iter_sentence_candidates(chunk_files):
+    for chunk_file in chunk_files:
+        with open(chunk_file, "r", encoding="utf-8") as fp:
+            for line in fp:
+                sentence = line.rstrip("\n")
+                if sentence:
+                    yield sentence
@@ -0,0 +1,74 @@
+import json
+
+
+# Yields the entries of a JSON array file (or a JSON Lines file ending in .jsonl) one at a time
+# Only about chunk_size characters of the file are held in memory, no matter how big the file is
+def iter_json_records(json_file, chunk_size=1 << 16):
+    with open(json_file, "r", encoding="utf-8") as fp:
+        if json_file.endswith(".jsonl"):
+            for line in fp:
+                if line.strip():
+                    yield json.loads(line)
+            return
+
+        decoder = json.JSONDecoder()
+        buffer = ""
+        pos = 0
+        started = False
+
+        while True:
+            # Skip the separators between entries
+            while pos < len(buffer) and (buffer[pos].isspace() or (started and buffer[pos] == ",")):
+                pos += 1
+
+            # Read more of the file once the buffer is used up
+            if pos == len(buffer):
+                buffer = fp.read(chunk_size)
+                pos = 0
+                if not buffer:
+                    if started:
+                        raise ValueError(f"Unexpected end of JSON array in {json_file}")
+                    return
+                continue
+
+            if not started:
+                if buffer[pos] != "[":
+                    raise ValueError(f"Expected a JSON array in {json_file}")
+                started = True
+                pos += 1
+                continue
+
+            if buffer[pos] == "]":
+                return
+
+            # An entry is only complete once the separator after it is in the buffer (a number might continue in the next chunk)
+            try:
+                entry, end = decoder.raw_decode(buffer, pos)
+                rest = buffer[end:].lstrip()
+                cut_off = not rest or rest[0] not in ",]"
+            except json.JSONDecodeError:
+                cut_off = True
+
+            # The entry is cut off at the end of the buffer, so keep it and read more
+            if cut_off:
+                chunk = fp.read(chunk_size)
+                if chunk:
+                    buffer = buffer[pos:] + chunk
+                    pos = 0
+                    continue
+                entry, end = decoder.raw_decode(buffer, pos)
+
+            yield entry
+            pos = end
+
+
+# Yields lists of batch_size items from an iterable (the last batch may be smaller)
+def iter_batches(iterable, batch_size):
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
@@ -0,0 +1,105 @@
+from spacy.language import Language
+from spacy.matcher import DependencyMatcher
+from spacy.tokens import Doc
+
+
+# SVA verdict of the doc: 1 if every checked subject/verb pair agrees, 0 if there is an SVA error, or -1 if nothing could be checked
+Doc.set_extension("sva", default=-1, force=True)
+# The subject/verb pairs that were checked: pattern name, subject, verb, and whether they agree
+Doc.set_extension("sva_checks", default=None, force=True)
+
+
+SUBJECT_DEPS = ["nsubj", "nsubjpass"]
+FINITE_TAGS = ["VBZ", "VBP", "VBD"]  # past tense (VBD) is only checked for was/were
+NOUN_TAGS = ["NN", "NNS", "NNP", "NNPS"]
+
+# Verb or auxiliary with a subject
+VERB = {"RIGHT_ID": "verb", "RIGHT_ATTRS": {"POS": {"IN": ["VERB", "AUX"]}}}
+FINITE_VERB = {"RIGHT_ID": "verb", "RIGHT_ATTRS": {"POS": {"IN": ["VERB", "AUX"]}, "TAG": {"IN": FINITE_TAGS}}}
+FINITE_AUX = {"LEFT_ID": "verb", "REL_OP": ">", "RIGHT_ID": "aux", "RIGHT_ATTRS": {"DEP": {"IN": ["aux", "auxpass"]}, "TAG": {"IN": FINITE_TAGS}}}
+PRONOUN_SUBJECT = {"LEFT_ID": "verb", "REL_OP": ">", "RIGHT_ID": "subject", "RIGHT_ATTRS": {"DEP": {"IN": SUBJECT_DEPS}, "TAG": "PRP"}}
+NOUN_SUBJECT = {"LEFT_ID": "verb", "REL_OP": ">", "RIGHT_ID": "subject", "RIGHT_ATTRS": {"DEP": {"IN": SUBJECT_DEPS}, "TAG": {"IN": NOUN_TAGS}}}
+ANY_SUBJECT = {"LEFT_ID": "verb", "REL_OP": ">", "RIGHT_ID": "subject", "RIGHT_ATTRS": {"DEP": {"IN": SUBJECT_DEPS}}}
+CONJUNCT = {"LEFT_ID": "subject", "REL_OP": ">", "RIGHT_ID": "conjunct", "RIGHT_ATTRS": {"DEP": "conj"}}
+
+# The common agreement patterns (the finite verb is the auxiliary if there is one, otherwise the verb itself)
+PATTERNS = {
+    "pronoun_aux": [VERB, FINITE_AUX, PRONOUN_SUBJECT],
+    "pronoun_verb": [FINITE_VERB, PRONOUN_SUBJECT],
+    "noun_aux": [VERB, FINITE_AUX, NOUN_SUBJECT],
+    "noun_verb": [FINITE_VERB, NOUN_SUBJECT],
+    "coordinated_aux": [VERB, FINITE_AUX, ANY_SUBJECT, CONJUNCT],
+    "coordinated_verb": [FINITE_VERB, ANY_SUBJECT, CONJUNCT],
+}
+
+
+# Returns the form of "be" and the verb tag (VBZ/VBP) a subject takes in the present tense, and the past form of "be"
+def expected_forms(subject):
+    # Coordinated subjects are plural
+    if any(child.dep_ == "conj" for child in subject.children):
+        return "are", "VBP", "were"
+
+    word = subject.lower_
+    if subject.tag_ == "PRP":
+        if word == "i":
+            return "am", "VBP", "was"
+        if word in ("he", "she", "it"):
+            return "is", "VBZ", "was"
+        return "are", "VBP", "were"
+
+    if subject.tag_ in ("NNS", "NNPS"):
+        return "are", "VBP", "were"
+    return "is", "VBZ", "was"
+
+
+# Returns True if the finite verb agrees with the subject, False if it does not, or None if the verb is not checked
+def agrees(verb, subject):
+    be_present, tag, be_past = expected_forms(subject)
+    word = verb.lower_
+
+    if word in ("am", "is", "are"):
+        return word == be_present
+    if word in ("was", "were"):
+        return word == be_past
+    if verb.tag_ == "VBD":
+        # The past form is the same for all persons
+        return None
+    return verb.tag_ == tag
+
+
+# Creates the rule-compiled SVA checker
+# Runs inside the pipeline (e.g. during nlp.pipe) and sets doc._.sva and doc._.sva_checks
+@Language.factory("sva_matcher")
+def create_sva_matcher(nlp, name):
+    matcher = DependencyMatcher(nlp.vocab)
+    for pattern_name, pattern in PATTERNS.items():
+        matcher.add(pattern_name, [pattern])
+    pattern_ids = {pattern_name: [node["RIGHT_ID"] for node in pattern] for pattern_name, pattern in PATTERNS.items()}
+
+    def sva_matcher(doc):
+        checks = {}
+        for match_id, token_ids in matcher(doc):
+            pattern_name = doc.vocab.strings[match_id]
+            tokens = {node: doc[i] for node, i in zip(pattern_ids[pattern_name], token_ids)}
+            verb = tokens.get("aux", tokens["verb"])
+            subject = tokens["subject"]
+
+            result = agrees(verb, subject)
+            if result is None:
+                continue
+
+            # The same pair can match several patterns; keep the most specific (coordinated) one
+            key = (verb.i, subject.i)
+            if key not in checks or pattern_name.startswith("coordinated"):
+                checks[key] = {"pattern": pattern_name, "subject": subject.text, "verb": verb.text, "agrees": result}
+
+        doc._.sva_checks = list(checks.values())
+        if not checks:
+            doc._.sva = -1
+        elif all(check["agrees"] for check in checks.values()):
+            doc._.sva = 1
+        else:
+            doc._.sva = 0
+        return doc
+
+    return sva_matcher
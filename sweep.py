@@ -0,0 +1,211 @@
+import glob
+import itertools
+import json
+import math
+import multiprocessing
+import os
+import shutil
+import statistics
+from concurrent.futures import ProcessPoolExecutor
+import polars as pl
+import torch
+from datasets import load_from_disk
+from transformers import AutoTokenizer, AutoModelForSequenceClassification, TrainingArguments, Trainer, TrainerCallback
+from fine_tune_llm import tokenize_function, convert_df_to_dataset, compute_metrics, decide_train_size
+
+
+SWEEP_DIR = "./llm/sweep"
+TOKENIZED_DIR = os.path.join(SWEEP_DIR, "tokenized")
+SOURCE_FILES = ["./data/train_sva_data.json", "./data/valid_sva_data.json"]
+SUBSET_SEED = 42  # seed of the training subsets, so trials are comparable and the sweep can be reproduced
+
+# Hyperparameter values to try (every combination is one trial)
+GRID = {
+    "learning_rate": [2e-5, 5e-5],
+    "num_epochs": [1, 2],
+    "batch_size": [8, 16],
+    "train_fraction": [0.25, 0.5, 1.0],
+}
+
+
+# Stops a trial early if its validation accuracy is below the median of the other trials at the same point of training
+class PruningCallback(TrainerCallback):
+    def __init__(self, scores, lock, evals_per_epoch, min_trials=2):
+        self.scores = scores
+        self.lock = lock
+        self.evals_per_epoch = evals_per_epoch
+        self.min_trials = min_trials
+        self.pruned = False
+
+    def on_evaluate(self, args, state, control, metrics=None, **kwargs):
+        # Trials with different batch sizes evaluate at different steps, so compare by the fraction of epochs done
+        eval_round = int(state.epoch * self.evals_per_epoch + 0.5)
+        accuracy = metrics["eval_accuracy"]
+
+        with self.lock:
+            previous = self.scores.get(eval_round, [])
+            self.scores[eval_round] = previous + [accuracy]
+
+        if len(previous) >= self.min_trials and accuracy < statistics.median(previous):
+            print(f"Pruning trial at epoch {state.epoch:.2f} (accuracy {accuracy:.3f})")
+            self.pruned = True
+            control.should_training_stop = True
+
+
+# Returns the size and modification time of each source data file
+def source_fingerprint():
+    return {file: [os.path.getsize(file), os.path.getmtime(file)] for file in SOURCE_FILES}
+
+
+# Tokenizes the training and validation data once and saves it to disk
+# Every trial memory-maps the same Arrow files instead of tokenizing again
+# The fingerprint of the source files is saved next to the tokenized data, so the data is tokenized again when they change
+def prepare_tokenized_data():
+    fingerprint_file = os.path.join(SWEEP_DIR, "tokenized_source.json")
+    fingerprint = source_fingerprint()
+    if os.path.exists(TOKENIZED_DIR) and os.path.exists(fingerprint_file):
+        with open(fingerprint_file, "r", encoding="utf-8") as fp:
+            if json.load(fp) == fingerprint:
+                return
+    if os.path.exists(TOKENIZED_DIR):
+        shutil.rmtree(TOKENIZED_DIR)
+
+    tokenizer = AutoTokenizer.from_pretrained("distilbert-base-uncased")
+    pl_train = pl.read_json(SOURCE_FILES[0]).to_pandas()
+    pl_valid = pl.read_json(SOURCE_FILES[1]).to_pandas()
+    dataset = convert_df_to_dataset(pl_train, pl_valid)
+    tokenized_datasets = dataset.map(lambda x: tokenize_function(tokenizer, x), batched=True)
+    tokenized_datasets.save_to_disk(TOKENIZED_DIR)
+
+    with open(fingerprint_file, "w", encoding="utf-8") as fp:
+        json.dump(fingerprint, fp, indent=4)
+
+
+# Caps the threads of a trial worker process so parallel trials do not oversubscribe the CPU
+def init_trial_worker(num_threads):
+    torch.set_num_threads(num_threads)
+    try:
+        torch.set_num_interop_threads(1)
+    except RuntimeError:
+        # The inter-op pool can only be set before it is first used
+        pass
+
+
+# Trains and evaluates one combination of hyperparameters on the shared tokenized data
+# Returns the trial's hyperparameters, best validation accuracy, and whether it was pruned
+def run_trial(trial_id, params, scores, lock, evals_per_epoch=2):
+    tokenized_datasets = load_from_disk(TOKENIZED_DIR)
+    train_dataset = tokenized_datasets["train"]
+    valid_dataset = tokenized_datasets["validation"]
+
+    # Take a class-balanced subset of the training data (only the labels are loaded to choose it)
+    # The draw is seeded, so every trial with the same fraction trains on the same subset
+    if params["train_fraction"] < 1:
+        pd_labels = train_dataset.select_columns(["label"]).to_pandas()
+        pd_labels["row"] = range(len(pd_labels))
+        pd_sampled = decide_train_size(pd_labels, int(len(pd_labels) * params["train_fraction"]), random_state=SUBSET_SEED)
+        train_dataset = train_dataset.select(pd_sampled["row"].tolist())
+
+    steps_per_epoch = math.ceil(len(train_dataset) / params["batch_size"])
+    eval_steps = max(1, steps_per_epoch // evals_per_epoch)
+    trial_dir = os.path.join(SWEEP_DIR, f"trial_{trial_id:03d}")
+
+    training_args = TrainingArguments(
+        output_dir=trial_dir,                                   # Directory to save the model
+        num_train_epochs=params["num_epochs"],                  # Total number of training epochs
+        learning_rate=params["learning_rate"],                  # Initial learning rate
+        per_device_train_batch_size=params["batch_size"],       # Batch size for training
+        per_device_eval_batch_size=params["batch_size"],        # Batch size for evaluation
+        logging_steps=50,                                       # Log every 50 steps
+        eval_strategy="steps",                                  # Run evaluation evals_per_epoch times per epoch
+        eval_steps=eval_steps,
+        save_strategy="steps",                                  # Save the model at every evaluation
+        save_steps=eval_steps,
+        save_total_limit=1,                                     # Keep only the best checkpoint
+        load_best_model_at_end=True,                            # Load the best model found during training
+        metric_for_best_model="accuracy",                       # The best model has the highest validation accuracy
+        use_cpu=True,                                           # Trials run in parallel on the CPU
+    )
+
+    pruning = PruningCallback(scores, lock, evals_per_epoch)
+    trainer = Trainer(
+        model=AutoModelForSequenceClassification.from_pretrained("distilbert-base-uncased", num_labels=2),
+        args=training_args,
+        train_dataset=train_dataset,
+        eval_dataset=valid_dataset,
+        compute_metrics=compute_metrics,
+        callbacks=[pruning],
+    )
+    trainer.train()
+
+    # Save the best model of the trial and delete its checkpoints
+    trainer.save_model(os.path.join(trial_dir, "best"))
+    for checkpoint in glob.glob(os.path.join(trial_dir, "checkpoint-*")):
+        shutil.rmtree(checkpoint)
+
+    return {
+        "trial": trial_id,
+        **params,
+        "accuracy": trainer.state.best_metric,
+        "pruned": pruning.pruned,
+        "model_dir": os.path.join(trial_dir, "best"),
+    }
+
+
+# Runs every combination of the grid as a trial, max_parallel trials at a time in separate processes
+# Writes a leaderboard and keeps only the best model (in ./llm/sweep/best_llm)
+def run_sweep(grid=GRID, max_parallel=2, threads_per_trial=None):
+    prepare_tokenized_data()
+
+    threads_per_trial = threads_per_trial or max(1, (os.cpu_count() or 1) // max_parallel)
+    trials = [dict(zip(grid, values)) for values in itertools.product(*grid.values())]
+
+    # Spawned workers read the thread limits from the environment before their thread pools start
+    # The limits are only set while the workers run; the old values are restored afterwards
+    thread_variables = ("OMP_NUM_THREADS", "MKL_NUM_THREADS")
+    old_values = {variable: os.environ.get(variable) for variable in thread_variables}
+    for variable in thread_variables:
+        os.environ[variable] = str(threads_per_trial)
+
+    try:
+        context = multiprocessing.get_context("spawn")
+        with context.Manager() as manager:
+            scores = manager.dict()
+            lock = manager.Lock()
+            with ProcessPoolExecutor(
+                max_workers=max_parallel, mp_context=context, initializer=init_trial_worker, initargs=(threads_per_trial,)
+            ) as executor:
+                futures = [executor.submit(run_trial, i, params, scores, lock) for i, params in enumerate(trials)]
+                results = [future.result() for future in futures]
+    finally:
+        for variable, value in old_values.items():
+            if value is None:
+                os.environ.pop(variable, None)
+            else:
+                os.environ[variable] = value
+
+    leaderboard = sorted(results, key=lambda r: r["accuracy"] or 0, reverse=True)
+
+    # Keep only the best model
+    best_dir = os.path.join(SWEEP_DIR, "best_llm")
+    if os.path.exists(best_dir):
+        shutil.rmtree(best_dir)
+    shutil.copytree(leaderboard[0]["model_dir"], best_dir)
+    for result in leaderboard:
+        shutil.rmtree(os.path.dirname(result["model_dir"]))
+        result["model_dir"] = None
+    leaderboard[0]["model_dir"] = best_dir
+
+    with open(os.path.join(SWEEP_DIR, "leaderboard.json"), "w", encoding="utf-8") as fp:
+        json.dump(leaderboard, fp, indent=4)
+
+    print("Leaderboard:")
+    for rank, result in enumerate(leaderboard, start=1):
+        print(f"  {rank}. accuracy {result['accuracy']} lr={result['learning_rate']} epochs={result['num_epochs']} "
+              f"batch={result['batch_size']} fraction={result['train_fraction']}{' (pruned)' if result['pruned'] else ''}")
+
+    return best_dir
+
+
+if __name__ == "__main__":
+    run_sweep()